@@ -0,0 +1,74 @@
+# standard library
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_rows(devices: int, per_reservation=5, re1_rate=0.2, console_rate=0.9, seed=0) -> list:
+    """
+    Synthetic LRM 'rows' shaped like the reservations API.
+    Some devices have RE1, and some have no console, by the given rates.
+    """
+    rand = random.Random(seed)
+    rows = []
+    for i in range(devices):
+        mgt_ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+        console_ip = None
+        console_re1_ip = None
+        if rand.random() < console_rate:
+            console_ip = f"100.64.{(i >> 8) & 255}.{i & 255}:{7000 + i % 48}"
+            if rand.random() < re1_rate and (i & 255) < 255:
+                console_re1_ip = f"100.65.{(i >> 8) & 255}.{i & 255}:{7000 + i % 48}"
+        rows.append(
+            {
+                "name": f"bench-r{i}",
+                "reservation": {"comment": f"bench lab {i // per_reservation}"},
+                "mgt_ip_address": mgt_ip,
+                "console_ip_address": console_ip,
+                "console_re1_ip_address": console_re1_ip,
+            }
+        )
+    return rows
+
+
+class LRMServer:
+    """
+    Local stand-in of the LRM API serving a fixed payload.
+    With etag, conditional requests are answered with 304 like LRM.
+    """
+
+    def __init__(self, rows: list, etag=True):
+        self.body = json.dumps({"rows": rows}).encode("utf-8")
+        self.etag = '"bench-%d"' % len(self.body) if etag == True else None
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                if server.etag != None and self.headers.get("If-None-Match") == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(server.body)))
+                if server.etag != None:
+                    self.send_header("ETag", server.etag)
+                self.end_headers()
+                self.wfile.write(server.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/lrm/api/reservations"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
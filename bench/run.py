@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+Benchmark of jlab2crt against local stand-ins of LRM and VMM.
+Every scenario runs in a temporary SecureCRT sessions directory made from bench/Default.ini,
+so results only depend on the parameters and the machine.
+
+    python ./bench/run.py [--devices 2000] [--pods 4] [--vms 50] [--latency 0.05] [--failure-rate 0]
+                          [--repeat 3] [--only startup|lrm|vmm] [--output result.json] [--verbose]
+"""
+
+
+# standard library
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 3rd party packages
+from rich.table import Table
+from rich.console import Console
+
+# local modules
+from util.lrm import LRM
+from util.vmm import VMM
+from util.crt import CRT
+from util.timing import tracer
+from lrm_server import LRMServer, make_rows
+from vmm_server import VMMServer
+
+DEFAULT_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Default.ini")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules each mode loads on top of jlab2crt.py itself.
+STARTUP_MODES = {
+    "help": [],
+    "lrm": ["util.lrm"],
+    "vmm": ["util.vmm"],
+    "all": ["util.lrm", "util.vmm"],
+}
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.root = None
+        self.lrm_server = None
+        self.vmm_server = None
+        self.results = []
+        self.startup = []
+
+    def make_config(self, **options) -> dict:
+        output = options.get("backend", "ini")
+        config = {
+            "crt_path": os.path.join(self.root, "Sessions"),
+            "cache_dir": os.path.join(self.root, "cache"),
+            "directory": {
+                "lrm": {"top": "JNPR", "sub": "UltraLab", "old": "old"},
+                "vmm": {"top": "JNPR", "sub": "VMM", "old": "old", "jumphost": "jumphost"},
+            },
+            "archive": {"max_entries": 200},
+            "sync_mode": options.get("sync_mode", "incremental"),
+            "write_workers": self.args.write_workers,
+            "output": {"backend": output, "path": os.path.join(self.root, "export")},
+            "lrm": {
+                "username": "bench",
+                "password": "bench-password",
+                "timeout": 10,
+                "stream": options.get("stream", False),
+            },
+            "vmm": {
+                "adusername": "bench",
+                "adpassword": "bench-ad-password",
+                "labpassword": "bench-lab-password",
+                "username": "bench",
+                "password": "bench-password",
+                "pod": {"hosts": self.vmm_server.pods if self.vmm_server else []},
+                "jumphost": {
+                    "enable": self.args.jumphost,
+                    "hosts": self.vmm_server.jumphosts if self.vmm_server else [],
+                },
+                "keyword": {"exclude": ["ixia"]},
+                "latency": {"ttl": 3600, "alpha": 0.3},
+                "ssh_config": (
+                    os.path.join(self.root, "ssh_config") if self.vmm_server else None
+                ),
+                # The stand-ins' keys are new on every run, so keep them out of '~/.ssh/known_hosts'.
+                "known_hosts": os.path.join(self.root, "cache", "known_hosts"),
+            },
+        }
+        return config
+
+    def reset_root(self) -> None:
+        """
+        Fresh sessions directory and cache, keeping the ssh config of the stand-ins.
+        """
+        for name in ("Sessions", "cache", "export"):
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        os.makedirs(os.path.join(self.root, "Sessions"))
+        shutil.copy(DEFAULT_INI, os.path.join(self.root, "Sessions", "Default.ini"))
+
+    @contextlib.contextmanager
+    def quiet(self):
+        if self.args.verbose == True:
+            yield
+            return
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+    def measure(self, name, sessions, setup, run) -> dict:
+        """
+        setup() prepares the state untimed, run() is timed with tracing enabled.
+        The run with the median time among the repeats is reported.
+        """
+        runs = []
+        for _ in range(self.args.repeat):
+            self.reset_root()
+            tracer.enabled = False
+            with self.quiet():
+                setup()
+                tracer.reset()
+                tracer.enable()
+                start_time = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start_time
+            tracer.enabled = False
+            runs.append(self.summarize(name, sessions, elapsed))
+        runs.sort(key=lambda result: result["total"])
+        result = runs[len(runs) // 2]
+        result["totals"] = [run["total"] for run in runs]
+        if self.args.verbose == True:
+            tracer.report()
+        self.results.append(result)
+        return result
+
+    def summarize(self, name, sessions, elapsed) -> dict:
+        phases = {}
+        first_write = None
+        for record in tracer.spans:
+            calls, total = phases.get(record["name"], (0, 0))
+            phases[record["name"]] = (calls + 1, total + record["duration"])
+            if record["name"] in ("crt.write", "backend.write"):
+                end = record["start"] + record["duration"]
+                first_write = end if first_write == None else min(first_write, end)
+        return {
+            "scenario": name,
+            "sessions": sessions,
+            "total": elapsed,
+            "sessions_per_sec": sessions / elapsed if elapsed > 0 else 0,
+            "time_to_first_session": first_write,
+            "counters": dict(tracer.counters),
+            "phases": {
+                phase: {"calls": calls, "total": total}
+                for phase, (calls, total) in sorted(phases.items())
+            },
+        }
+
+    def check_dir(self, config, kind) -> None:
+        CRT(config, kind, {}).is_exist_or_make()
+
+    def run_lrm(self) -> None:
+        rows = make_rows(
+            self.args.devices,
+            re1_rate=self.args.re1_rate,
+            console_rate=self.args.console_rate,
+            seed=self.args.seed,
+        )
+        sessions = sum(
+            len(group) for group in LRM("", self.make_config()).get_sessions(rows).values()
+        )
+        self.lrm_server = LRMServer(rows).start()
+        url = self.lrm_server.url
+
+        def lrm_run(**options):
+            config = self.make_config(**options)
+            self.check_dir(config, "lrm")
+            LRM(url, config).run()
+
+        def nothing():
+            pass
+
+        # The ETag of the stand-in is turned off to make LRM answer the whole body.
+        def without_etag(func):
+            def wrapper():
+                etag, self.lrm_server.etag = self.lrm_server.etag, None
+                try:
+                    func()
+                finally:
+                    self.lrm_server.etag = etag
+
+            return wrapper
+
+        self.measure("lrm cold", sessions, nothing, lrm_run)
+        self.measure("lrm not modified (304)", sessions, lrm_run, lrm_run)
+        self.measure("lrm resync unchanged", sessions, lrm_run, without_etag(lrm_run))
+        self.measure(
+            "lrm stream cold", sessions, nothing, lambda: lrm_run(stream=True)
+        )
+        self.measure(
+            "lrm rebuild",
+            sessions,
+            lrm_run,
+            without_etag(lambda: lrm_run(sync_mode="rebuild")),
+        )
+        for backend in ("xml", "ssh", "json"):
+            self.measure(
+                f"lrm export {backend}",
+                sessions,
+                nothing,
+                lambda: lrm_run(backend=backend),
+            )
+        self.lrm_server.stop()
+
+    def run_vmm(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.vmm_server = VMMServer(
+            pods=self.args.pods,
+            vms=self.args.vms,
+            latency=self.args.latency,
+            failure_rate=self.args.failure_rate,
+            seed=self.args.seed,
+        )
+        loop.run_until_complete(self.vmm_server.start())
+        self.vmm_server.ssh_config(os.path.join(self.root, "ssh_config"))
+        vms = len([i for i in range(self.args.vms) if i % 10 != 9])
+        sessions = self.args.pods * vms + (1 if self.args.jumphost == True else 0)
+
+        def vmm_run(**options):
+            config = self.make_config(**options)
+            self.check_dir(config, "vmm")
+            VMM(config).run()
+
+        def nothing():
+            pass
+
+        self.measure("vmm cold", sessions, nothing, vmm_run)
+        self.measure("vmm warm", sessions, vmm_run, vmm_run)
+        self.measure("vmm export ssh", sessions, nothing, lambda: vmm_run(backend="ssh"))
+        loop.run_until_complete(self.vmm_server.stop())
+        loop.close()
+
+    def get_import_times(self, code) -> tuple:
+        """
+        Run code in a fresh interpreter with '-X importtime'.
+        Return ({outermost module: cumulative seconds}, {top-level package: cumulative seconds}).
+        """
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        outermost = {}
+        packages = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if cumulative.strip() == "cumulative":
+                continue
+            seconds = int(cumulative) / 1000000
+            if not name.startswith("  "):
+                outermost[name.strip()] = seconds
+            if "." not in name:
+                packages[name.strip()] = seconds
+        return outermost, packages
+
+    def run_startup(self) -> None:
+        """
+        Import time and process time of the modules each mode loads, in fresh interpreters.
+        """
+        interpreter = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "pass"],
+            capture_output=True,
+            text=True,
+        )
+        baseline = set()
+        for line in interpreter.stderr.splitlines():
+            if "|" in line:
+                baseline.add(line.split("|")[2].strip())
+        for mode, modules in STARTUP_MODES.items():
+            code = "; ".join(f"import {module}" for module in ["jlab2crt"] + modules)
+            runs = []
+            for _ in range(self.args.repeat):
+                times, packages = self.get_import_times(code)
+                for name in baseline:
+                    times.pop(name, None)
+                for name in baseline | set(["jlab2crt", "util"]):
+                    packages.pop(name, None)
+                start_time = time.perf_counter()
+                subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, check=True)
+                runs.append(
+                    {
+                        "mode": mode,
+                        "imports": sum(times.values()),
+                        "process": time.perf_counter() - start_time,
+                        "heaviest": sorted(packages.items(), key=lambda item: -item[1])[:5],
+                    }
+                )
+            runs.sort(key=lambda run: run["imports"])
+            self.startup.append(runs[len(runs) // 2])
+
+    def report(self) -> None:
+        console = Console()
+        if console.is_terminal == False:
+            # Keep the tables readable when the results are redirected to a file.
+            console = Console(width=160)
+        if len(self.startup) != 0:
+            startup_table = Table(title="Startup")
+            startup_table.add_column("Mode")
+            startup_table.add_column("Imports (ms)", justify="right")
+            startup_table.add_column("Process (ms)", justify="right")
+            startup_table.add_column("Heaviest imports (ms)")
+            for result in self.startup:
+                startup_table.add_row(
+                    result["mode"],
+                    f"{result['imports'] * 1000:.0f}",
+                    f"{result['process'] * 1000:.0f}",
+                    ", ".join(
+                        f"{name} {seconds * 1000:.0f}" for name, seconds in result["heaviest"]
+                    ),
+                )
+            console.print(startup_table)
+        if len(self.results) == 0:
+            return
+        table = Table(title="jlab2crt benchmark")
+        table.add_column("Scenario")
+        table.add_column("Sessions", justify="right")
+        table.add_column("Total (s)", justify="right")
+        table.add_column("Sessions/s", justify="right")
+        table.add_column("First session (ms)", justify="right")
+        table.add_column("Written", justify="right")
+        table.add_column("Read", justify="right")
+        table.add_column("HTTP (KB)", justify="right")
+        for result in self.results:
+            counters = result["counters"]
+            first = result["time_to_first_session"]
+            table.add_row(
+                result["scenario"],
+                str(result["sessions"]),
+                f"{result['total']:.3f}",
+                f"{result['sessions_per_sec']:.0f}",
+                "-" if first == None else f"{first * 1000:.1f}",
+                str(
+                    counters.get("crt.files_written", 0)
+                    + counters.get("backend.files_written", 0)
+                ),
+                str(counters.get("crt.files_read", 0)),
+                f"{counters.get('http.bytes', 0) / 1024:.0f}",
+            )
+        console.print(table)
+
+        phase_table = Table(title="Phases (s)")
+        phase_table.add_column("Scenario")
+        phase_table.add_column("Phase")
+        phase_table.add_column("Calls", justify="right")
+        phase_table.add_column("Total (s)", justify="right")
+        for result in self.results:
+            for phase, figure in result["phases"].items():
+                phase_table.add_row(
+                    result["scenario"], phase, str(figure["calls"]), f"{figure['total']:.3f}"
+                )
+        console.print(phase_table)
+
+    def run(self) -> None:
+        self.root = tempfile.mkdtemp(prefix="jlab2crt-bench-")
+        try:
+            if self.args.only in (None, "startup"):
+                self.run_startup()
+            if self.args.only in (None, "lrm"):
+                self.run_lrm()
+            if self.args.only in (None, "vmm"):
+                self.run_vmm()
+        finally:
+            shutil.rmtree(self.root, ignore_errors=True)
+        self.report()
+        if self.args.output != None:
+            with open(self.args.output, "w", encoding="UTF-8") as f:
+                json.dump(
+                    {
+                        "parameters": vars(self.args),
+                        "startup": self.startup,
+                        "results": self.results,
+                    },
+                    f,
+                    indent=2,
+                )
+            print(f"Results: {self.args.output}")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark jlab2crt with local LRM and VMM stand-ins."
+    )
+    add = parser.add_argument
+    add("--devices", type=int, default=2000, help="LRM devices in the payload")
+    add("--re1-rate", type=float, default=0.2, help="rate of devices with RE1")
+    add("--console-rate", type=float, default=0.9, help="rate of devices with a console")
+    add("--pods", type=int, default=4, help="VMM pods")
+    add("--vms", type=int, default=50, help="VMs per pod, every 10th is an excluded ixia")
+    add("--latency", type=float, default=0.05, help="seconds for a command on the pods")
+    add("--failure-rate", type=float, default=0.0, help="rate of failing 'vmm ip'")
+    add("--no-jumphost", dest="jumphost", action="store_false", help="connect to pods directly")
+    add("--write-workers", type=int, default=8)
+    add("--repeat", type=int, default=3, help="runs of each scenario, the median is reported")
+    add("--seed", type=int, default=0)
+    add("--only", choices=["startup", "lrm", "vmm"])
+    add("--output", help="write the results to a JSON file")
+    add("--verbose", action="store_true", help="show jlab2crt's output and each profile")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    Bench(get_args()).run()
@@ -0,0 +1,116 @@
+# standard library
+import os
+import random
+import asyncio
+
+# 3rd party packages
+import asyncssh
+
+POD_MARKER = "--JLAB2CRT-POD--"
+
+
+class BenchSSHServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+    def connection_requested(self, dest_host, dest_port, orig_host, orig_port):
+        # Let the jumphost tunnel to the pods.
+        return True
+
+
+class VMMServer:
+    """
+    Local stand-ins of jumphosts and VMM pods. Every host listens on its own port of 127.0.0.1,
+    and ssh_config() maps the host names to them for 'vmm.ssh_config'.
+    Pods answer 'vmm ip' and 'cat ~/.vmmgr/<pod>.config.db' (also batched) with the given latency,
+    and 'vmm ip' fails by failure_rate.
+    The n-th jumphost and pod are slower by half of the latency each, so the fastest ones are always
+    the same and the sessions don't change with the chosen jumphost between runs.
+    """
+
+    def __init__(self, pods=4, vms=20, jumphosts=2, latency=0.05, failure_rate=0.0, seed=0):
+        self.pods = [f"pod{i}.bench.lab" for i in range(pods)]
+        self.jumphosts = [f"jh{i}.bench.lab" for i in range(jumphosts)]
+        self.vms = vms
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rand = random.Random(seed)
+        self.servers = []
+        self.ports = {}
+        self.commands = 0
+        self.failures = 0
+
+    def get_config_line(self, pod: str) -> str:
+        topo = pod.split(".")[0] + "-topo"
+        return f"Config-file = /homes/bench/{topo}/vmm/config.cfg\n"
+
+    def get_vmm_ip(self, pod: str) -> str:
+        index = self.pods.index(pod)
+        lines = []
+        for i in range(self.vms):
+            kind = "ixia" if i % 10 == 9 else "vm"
+            lines.append(f"{kind}{i} 172.{16 + index % 16}.{i >> 8}.{i & 255}\n")
+        return "".join(lines)
+
+    def make_handler(self, host: str):
+        hosts = self.jumphosts if host in self.jumphosts else self.pods
+        scale = 1 + hosts.index(host) * 0.5
+
+        async def handle(process):
+            self.commands += 1
+            command = process.command or ""
+            # Read on every command so a scenario can slow the hosts down midway.
+            await asyncio.sleep(self.latency * scale)
+            if command == "vmm ip":
+                if self.rand.random() < self.failure_rate:
+                    self.failures += 1
+                    process.stderr.write("vmm: failed to connect to the VMM server\n")
+                    process.exit(1)
+                    return
+                process.stdout.write(self.get_vmm_ip(host))
+            elif "config.db" in command:
+                output = ""
+                for part in command.split("; "):
+                    if part.startswith("echo"):
+                        output += part.split(" ", 1)[1].strip("'") + "\n"
+                    elif part.startswith("cat"):
+                        pod = part.split("/")[-1].split(".config.db")[0].strip("'")
+                        if pod in self.pods:
+                            output += self.get_config_line(pod)
+                process.stdout.write(output)
+            else:
+                process.stdout.write("test\n")
+            process.exit(0)
+
+        return handle
+
+    async def start(self):
+        key = asyncssh.generate_private_key("ssh-ed25519")
+        for host in self.jumphosts + self.pods:
+            server = await asyncssh.create_server(
+                BenchSSHServer,
+                "127.0.0.1",
+                0,
+                server_host_keys=[key],
+                process_factory=self.make_handler(host),
+            )
+            self.servers.append(server)
+            self.ports[host] = server.sockets[0].getsockname()[1]
+        return self
+
+    def ssh_config(self, path: str) -> str:
+        with open(path, "w", encoding="UTF-8") as f:
+            for host, port in self.ports.items():
+                f.write(f"Host {host}\n    HostName 127.0.0.1\n    Port {port}\n\n")
+        return path
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
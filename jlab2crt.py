@@ -11,23 +11,27 @@
 
 
 # standard library
+import os
 import sys
+import time
 import platform
 import getpass
 
-# 3rd party packages
-import yaml
-
-# local modules
-from util.lrm import LRM
-from util.crt import CRT
-from util.vmm import VMM
+# 3rd party packages and local modules are imported where they are needed,
+# so that a run only loads what its mode uses. e.g. '-k lrm' never loads asyncssh.
+# See 'python ./bench/run.py --only startup' for the cost of imports.
 
 
 OS = platform.system()
 USER_NAME = getpass.getuser()
-# URL has been removed
-LRM_URL = f"https://[[REMOVED]]?reserved_by={USER_NAME}&_flat"
+
+
+def get_lrm_url(user_name) -> str:
+    # URL has been removed
+    return f"https://[[REMOVED]]?reserved_by={user_name}&_flat"
+
+
+LRM_URL = get_lrm_url(USER_NAME)
 
 
 def default_session_path() -> str:
@@ -40,13 +44,31 @@ def default_session_path() -> str:
     return SESSION_PATH
 
 
-def get_config() -> tuple:
+def default_cache_path() -> str:
+    return os.path.join(os.path.expanduser("~"), ".jlab2crt")
+
+
+def get_config(kinds, is_batch=False) -> dict:
+    import yaml
+
     with open("config.yml", "r", encoding="UTF-8") as f:
         config = yaml.safe_load(f)
-        if config["crt_path"] == None:
+        output = config.get("output") or {}
+        # Single-file backends don't need SecureCRT, e.g. on Linux build hosts.
+        # Batch mode writes to the users' paths, and only needs crt_path for its Default.ini.
+        if (
+            config["crt_path"] == None
+            and (output.get("backend") or "ini") == "ini"
+            and is_batch == False
+        ):
             config["crt_path"] = default_session_path()
+        if config.get("cache_dir") == None:
+            config["cache_dir"] = default_cache_path()
         if config["vmm"]["adusername"] == None:
             config["vmm"]["adusername"] = getpass.getuser()
+        # VMM's passwords are not asked for LRM only runs.
+        if "vmm" not in kinds:
+            return config
         if config["vmm"]["adpassword"] == None:
             config["vmm"]["adpassword"] = getpass.getpass(
                 prompt="###################################\n#    Please input AD password     # \n###################################\n - Password: ",
@@ -61,6 +83,8 @@ def get_config() -> tuple:
 
 
 def check_dir(config, kind):
+    from util.crt import CRT
+
     CRT(
         config,
         kind,
@@ -68,9 +92,177 @@ def check_dir(config, kind):
     ).is_exist_or_make()
 
 
+def run_all(config, lrm=None, vmm=None) -> dict:
+    """
+    Run LRM and VMM concurrently.
+    LRM's HTTP fetch and its sessions run on a worker thread while VMM's SSH work runs on the main thread's event loop.
+    """
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+    from util.lrm import LRM
+
+    timings = {}
+    # {name: exception} of the side(s) that failed. Neither side stops the other.
+    errors = {}
+
+    def timed(name, func):
+        start_time = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            errors[name] = e
+        finally:
+            timings[name] = time.perf_counter() - start_time
+
+    def run_vmm():
+        # asyncssh takes long to import, so it is loaded while LRM is already being fetched.
+        from util.vmm import VMM
+
+        check_dir(config, "vmm")
+        (vmm or VMM(config)).run()
+
+    lrm = lrm or LRM(LRM_URL, config)
+    check_dir(config, "lrm")
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(
+            contextvars.copy_context().run, timed, "LRM", lrm.run
+        )
+        try:
+            timed("VMM", run_vmm)
+        finally:
+            # Wait for LRM whatever happened to VMM, so that its result is never lost.
+            future.result()
+    elapsed = time.perf_counter() - start_time
+
+    print("Timings:")
+    for name, timing in timings.items():
+        print(f" - {name}: {timing:.2f}s{' (failed)' if name in errors else ''}")
+    print(f" - Total: {elapsed:.2f}s (overlapped {sum(timings.values()) - elapsed:.2f}s)")
+    for name, error in errors.items():
+        print(f"{name} failed: {error}")
+    if len(errors) != 0:
+        raise next(iter(errors.values()))
+    return timings
+
+
+def watch(config, kinds):
+    """
+    Keep refreshing sessions until interrupted.
+    Config, passwords, LRM's HTTP session and VMM's SSH connections are kept between refreshes,
+    and only what changed is applied to the session tree.
+    """
+    from util.watch import Watcher
+
+    watch_config = config.get("watch") or {}
+    # Rebuilding would rewrite every session on every refresh.
+    config["sync_mode"] = "incremental"
+    lrm = None
+    vmm = None
+    if "lrm" in kinds:
+        from util.lrm import LRM
+
+        lrm = LRM(LRM_URL, config)
+    if "vmm" in kinds:
+        from util.vmm import VMM
+
+        vmm = VMM(config, keep_alive=True)
+
+    def refresh():
+        if lrm != None and vmm != None:
+            return run_all(config, lrm, vmm)
+        kind, runner = ("lrm", lrm) if lrm != None else ("vmm", vmm)
+        check_dir(config, kind)
+        start_time = time.perf_counter()
+        runner.run()
+        return {kind.upper(): time.perf_counter() - start_time}
+
+    watcher = Watcher(
+        refresh,
+        config["cache_dir"],
+        interval=watch_config.get("interval") or 300,
+        jitter=watch_config.get("jitter", 30),
+    )
+    try:
+        watcher.run()
+    finally:
+        if vmm != None:
+            vmm.shutdown()
+
+
+def get_kinds(argv):
+    """
+    Return the kinds of lab to run from the arguments, or None if they are invalid.
+    """
+    argc = len(argv)
+    if argc == 1 or (argc == 2 and argv[1].lower() == "-a"):
+        return ["lrm", "vmm"]
+    if argc == 3 and argv[2].lower() in ("lrm", "vmm"):
+        return [argv[2].lower()]
+    return None
+
+
+def batch(config):
+    from util.batch import Batch
+
+    Batch(config, get_lrm_url).run()
+
+
+def main(config, kinds, is_watch, is_batch=False):
+    if is_batch == True:
+        batch(config)
+    elif is_watch == True:
+        watch(config, kinds)
+    elif len(kinds) == 2:
+        run_all(config)
+    elif kinds[0] == "lrm":
+        from util.lrm import LRM
+
+        check_dir(config, "lrm")
+        lrm = LRM(LRM_URL, config)
+        lrm.run()
+    else:
+        from util.vmm import VMM
+
+        check_dir(config, "vmm")
+        vmm = VMM(config)
+        vmm.run()
+
+
+def profile(config, kinds, is_watch, is_batch, use_cprofile):
+    """
+    Run main() with timing spans enabled, then print a summary and write the trace to cache_dir.
+    With cProfile, a '.prof' dump is written next to it. Open it with 'python -m pstats' or snakeviz.
+    """
+    from util.timing import tracer
+
+    tracer.enable()
+    trace_path = os.path.join(
+        config["cache_dir"], f"profile_{time.strftime('%Y%m%d_%H%M%S')}"
+    )
+    profiler = None
+    if use_cprofile == True:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with tracer.span("main"):
+            main(config, kinds, is_watch, is_batch)
+    finally:
+        if profiler != None:
+            profiler.disable()
+            profiler.dump_stats(trace_path + ".prof")
+        tracer.report()
+        tracer.save(trace_path + ".json")
+        print(f"Trace: {trace_path}.json")
+        if profiler != None:
+            print(f"cProfile: {trace_path}.prof")
+
+
 def help():
     print("Usage:")
-    print("    python ./jlab2crt.py [-a | -k <lrm|vmm>]")
+    print("    python ./jlab2crt.py [-a | -k <lrm|vmm>] [--watch | --batch] [--profile | --cprofile]")
     print("")
     print("    [-a]                   Create sessions from all kinds of lab(LRM/VMM).")
     print("                           This parameter applied by default.")
@@ -78,32 +270,40 @@ def help():
     print("    [-k <lrm|vmm>]         Create sessions selectively between LRM and VMM")
     print("                           This parameter is optional.")
     print("")
+    print("    [--watch]              Keep running and refresh sessions periodically.")
+    print("                           Interval is set by 'watch' in config.yml.")
+    print("")
+    print("    [--batch]              Create LRM sessions of every user in 'batch' of config.yml,")
+    print("                           each in its own directory. VMM is not included.")
+    print("")
+    print("    [--profile]            Print where the run spent its time and write a trace")
+    print("                           to the cache directory. (chrome://tracing, Perfetto)")
+    print("")
+    print("    [--cprofile]           Same as --profile, and also write a cProfile dump.")
+    print("")
 
 
 if __name__ == "__main__":
-    argc = len(sys.argv)
-    argv = sys.argv
+    options = [arg.lower() for arg in sys.argv if arg.startswith("--")]
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    is_watch = "--watch" in options
+    is_batch = "--batch" in options
+    kinds = get_kinds(argv)
+    if is_batch == True and kinds != None:
+        # Batch mode is for LRM only, so VMM's passwords are not asked.
+        kinds = None if kinds == ["vmm"] else ["lrm"]
 
-    config = get_config()
+    if (
+        kinds == None
+        or len(set(options) - set(["--watch", "--batch", "--profile", "--cprofile"])) != 0
+        or (is_watch == True and is_batch == True)
+    ):
+        help()
+        sys.exit()
 
-    if argc == 1 or (argc == 2 and argv[1].lower() == "-a"):
-        check_dir(config, "lrm")
-        lrm = LRM(LRM_URL, config)
-        lrm.run()
-        check_dir(config, "vmm")
-        vmm = VMM(config)
-        vmm.run()
-        pass
-    elif argc == 3:
-        if argv[2].lower() == "lrm":
-            check_dir(config, "lrm")
-            lrm = LRM(LRM_URL, config)
-            lrm.run()
-        elif argv[2].lower() == "vmm":
-            check_dir(config, "vmm")
-            vmm = VMM(config)
-            vmm.run()
-        else:
-            help()
+    config = get_config(kinds, is_batch)
+
+    if "--profile" in options or "--cprofile" in options:
+        profile(config, kinds, is_watch, is_batch, "--cprofile" in options)
     else:
-        help()
+        main(config, kinds, is_watch, is_batch)
@@ -0,0 +1,134 @@
+# standard library
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+
+
+class Archive:
+    """
+    Index of the expired directories in the 'old' directory.
+    index = {
+        "entries": {name: {"original": ..., "archived": epoch, "size": bytes}, ...},
+        "dups": {original: number of archived directories with that name, ...},
+    }
+    Collision-free names are assigned from "dups" without probing the disk, like
+    'name', 'name_dup', 'name_dup2', ... and the oldest entries are evicted by the
+    configured policies (max_entries, max_age_days, max_size_mb). Empty policies are unlimited.
+    """
+
+    def __init__(self, old_path: str, cache_dir: str, policy=None):
+        self.old_path = old_path
+        name = hashlib.sha1(old_path.encode("utf-8")).hexdigest()
+        self.index_path = os.path.join(cache_dir, f"archive_{name}.json")
+        policy = policy or {}
+        self.max_entries = policy.get("max_entries")
+        self.max_age_days = policy.get("max_age_days")
+        self.max_size_mb = policy.get("max_size_mb")
+        self.entries = {}
+        self.dups = {}
+        self.load()
+
+    def load(self) -> None:
+        """
+        Load the index and reconcile it with the directories actually in 'old'.
+        """
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="UTF-8") as f:
+                    index = json.load(f)
+                self.entries = index["entries"]
+                self.dups = index["dups"]
+            except (ValueError, KeyError):
+                self.entries, self.dups = {}, {}
+        exist = set()
+        if os.path.isdir(self.old_path):
+            with os.scandir(self.old_path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        exist.add(entry.name)
+        for name in list(self.entries):
+            if name not in exist:
+                del self.entries[name]
+        for name in exist - set(self.entries):
+            # Directories archived before the index existed.
+            path = os.path.join(self.old_path, name)
+            original = re.sub("(_dup[0-9]*)+$", "", name)
+            self.entries[name] = {
+                "original": original,
+                "archived": os.path.getmtime(path),
+                "size": self.get_size(path),
+            }
+            self.dups[original] = self.dups.get(original, 0) + 1
+
+    def get_size(self, path) -> int:
+        size = 0
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in file_names:
+                try:
+                    size += os.path.getsize(os.path.join(dir_path, file_name))
+                except OSError:
+                    pass
+        return size
+
+    def assign_name(self, original: str) -> str:
+        count = self.dups.get(original, 0)
+        while True:
+            if count == 0:
+                name = original
+            elif count == 1:
+                name = original + "_dup"
+            else:
+                name = f"{original}_dup{count}"
+            count += 1
+            # The disk is only checked to survive a stale index, normally it is free at once.
+            if name not in self.entries and not os.path.exists(
+                os.path.join(self.old_path, name)
+            ):
+                break
+        self.dups[original] = count
+        return name
+
+    def add(self, name: str, original: str) -> None:
+        self.entries[name] = {
+            "original": original,
+            "archived": time.time(),
+            "size": self.get_size(os.path.join(self.old_path, name)),
+        }
+
+    def evict(self) -> list:
+        """
+        Remove the oldest archived directories exceeding the policies. Return the removed names.
+        """
+        ordered = sorted(self.entries, key=lambda name: self.entries[name]["archived"])
+        total_size = sum(entry["size"] for entry in self.entries.values())
+        now = time.time()
+        evicted = []
+        for name in ordered:
+            entry = self.entries[name]
+            count = len(self.entries)
+            if (
+                (self.max_entries != None and count > self.max_entries)
+                or (
+                    self.max_age_days != None
+                    and now - entry["archived"] > self.max_age_days * 86400
+                )
+                or (
+                    self.max_size_mb != None
+                    and total_size > self.max_size_mb * 1024 * 1024
+                )
+            ):
+                shutil.rmtree(os.path.join(self.old_path, name), ignore_errors=True)
+                del self.entries[name]
+                total_size -= entry["size"]
+                evicted.append(name)
+        return evicted
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="UTF-8") as f:
+            json.dump({"entries": self.entries, "dups": self.dups}, f, indent=2)
+        os.replace(temp_path, self.index_path)
@@ -0,0 +1,181 @@
+# standard library
+import os
+import re
+import json
+from xml.sax.saxutils import escape, quoteattr
+
+# local modules
+from util.timing import tracer
+
+
+class Backend:
+    """
+    Output written in a single file instead of SecureCRT's session tree.
+    entries = [
+        {"folder": [top, sub, bundle], "name": ..., "session": Session, "username": ..., "password": ...},
+        ...
+    ]
+    The whole output is rendered in memory and written with one sequential write, then switched atomically.
+    """
+
+    extension = None
+
+    def __init__(self, output_dir: str, kind: str):
+        self.output_path = os.path.join(output_dir, f"jlab2crt_{kind}.{self.extension}")
+
+    def render(self, entries, encrypt) -> str:
+        raise NotImplementedError
+
+    def write(self, entries, encrypt) -> str:
+        """
+        encrypt is only called by backends keeping passwords, to make 'Password V2' blobs.
+        Return the written path.
+        """
+        with tracer.span("backend.render", backend=self.extension):
+            content = self.render(entries, encrypt)
+        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        temp_path = self.output_path + ".tmp"
+        with tracer.span("backend.write", backend=self.extension):
+            with open(temp_path, "w", encoding="UTF-8", newline="\n") as f:
+                f.write(content)
+            os.replace(temp_path, self.output_path)
+        tracer.count("backend.files_written")
+        tracer.count("backend.bytes_written", len(content))
+        return self.output_path
+
+
+class XMLBackend(Backend):
+    """
+    SecureCRT's XML settings file. Import it with 'File > Import Settings...' in SecureCRT.
+    Options not given here are taken from the default session of SecureCRT when imported.
+    """
+
+    extension = "xml"
+
+    def render(self, entries, encrypt) -> str:
+        # node = (sub folders, sessions)
+        tree = ({}, [])
+        for entry in entries:
+            node = tree
+            for folder in entry["folder"]:
+                node = node[0].setdefault(folder, ({}, []))
+            node[1].append(entry)
+
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>\n', '<VanDyke version="3.0">\n']
+
+        def add_key(name, node, depth):
+            indent = "\t" * depth
+            lines.append(f"{indent}<key name={quoteattr(name)}>\n")
+            for folder, child in node[0].items():
+                add_key(folder, child, depth + 1)
+            for entry in node[1]:
+                lines.append(f"{indent}\t<key name={quoteattr(entry['name'])}>\n")
+                add_session(entry, depth + 2)
+                lines.append(f"{indent}\t</key>\n")
+            lines.append(f"{indent}</key>\n")
+
+        def add_session(entry, depth):
+            indent = "\t" * depth
+            session = entry["session"]
+            values = [
+                ("string", "Hostname", session.host),
+                ("string", "Username", entry["username"]),
+                ("string", "Protocol Name", session.protocol),
+            ]
+            if session.protocol == "SSH2":
+                values.append(("dword", "[SSH2] Port", session.port))
+            else:
+                values.append(("dword", "Port", session.port))
+            if entry["password"] != None:
+                values.append(("string", "Password V2", "02:" + encrypt(entry["password"])))
+                values.append(("dword", "Session Password Saved", 1))
+            if entry.get("firewall") != None:
+                values.append(("string", "Firewall Name", f"Session:{entry['firewall']}"))
+            for type, name, value in values:
+                lines.append(
+                    f"{indent}<{type} name={quoteattr(name)}>{escape(str(value))}</{type}>\n"
+                )
+
+        add_key("Sessions", tree, 1)
+        lines.append("</VanDyke>\n")
+        return "".join(lines)
+
+
+class SSHConfigBackend(Backend):
+    """
+    OpenSSH client config fragment. Include it from '~/.ssh/config' like 'Include ~/.jlab2crt/export/jlab2crt_*.conf'.
+    Sessions behind the jumphost use ProxyJump to it. Telnet consoles cannot be expressed and are left out.
+    Passwords are never written.
+    """
+
+    extension = "conf"
+
+    def get_alias(self, entry) -> str:
+        name = f"{entry['folder'][-1]}/{entry['name']}"
+        return re.sub("[^A-Za-z0-9_.\\-/]", "_", name)
+
+    def render(self, entries, encrypt) -> str:
+        aliases = {}
+        for entry in entries:
+            if entry["session"].protocol == "SSH2":
+                aliases[entry["session"].host] = self.get_alias(entry)
+        lines = ["# Generated by jlab2crt. Changes will be overwritten.\n"]
+        for entry in entries:
+            session = entry["session"]
+            if session.protocol != "SSH2":
+                continue
+            lines.append(f"\nHost {self.get_alias(entry)}\n")
+            lines.append(f"    HostName {session.host}\n")
+            lines.append(f"    Port {session.port}\n")
+            if entry["username"]:
+                lines.append(f"    User {entry['username']}\n")
+            if session.jumphost != None:
+                lines.append(f"    ProxyJump {aliases.get(session.jumphost, session.jumphost)}\n")
+        return "".join(lines)
+
+
+class JSONBackend(Backend):
+    """
+    Plain dump of the sessions for other tools. Passwords are never written.
+    """
+
+    extension = "json"
+
+    def render(self, entries, encrypt) -> str:
+        sessions = []
+        for entry in entries:
+            session = entry["session"]
+            sessions.append(
+                {
+                    "folder": "/".join(entry["folder"]),
+                    "name": entry["name"],
+                    "type": session.type.name,
+                    "host": session.host,
+                    "protocol": session.protocol,
+                    "port": session.port,
+                    "username": entry["username"],
+                    "jumphost": session.jumphost,
+                }
+            )
+        return json.dumps({"sessions": sessions}, indent=2) + "\n"
+
+
+BACKENDS = {
+    "xml": XMLBackend,
+    "ssh": SSHConfigBackend,
+    "json": JSONBackend,
+}
+
+
+def get_backend(config: dict, kind: str):
+    """
+    Return the backend configured by 'output', or None for SecureCRT's session tree ('ini').
+    """
+    output = config.get("output") or {}
+    name = output.get("backend") or "ini"
+    if name == "ini":
+        return None
+    if name not in BACKENDS:
+        raise Exception(f"[Error] Unsupported output backend: {name}")
+    output_dir = output.get("path") or os.path.join(config["cache_dir"], "export")
+    return BACKENDS[name](os.path.expanduser(output_dir), kind)
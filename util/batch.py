@@ -0,0 +1,224 @@
+# standard library
+import os
+import copy
+import json
+import time
+import shutil
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# 3rd party packages
+from rich import print as rprint
+
+# local modules
+from util.crt import CRT
+from util.lrm import LRM, HEADERS
+from util.fetch import Fetcher
+from util.timing import tracer
+
+
+def render_tree(config: dict, sessions: dict, template: str) -> dict:
+    """
+    Write a user's session tree. Run in a worker process, so its output is discarded.
+    """
+    start_time = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        crt_path = config["crt_path"]
+        if crt_path != None:
+            os.makedirs(crt_path, exist_ok=True)
+            if os.path.exists(os.path.join(crt_path, "Default.ini")) == False:
+                shutil.copy(template, os.path.join(crt_path, "Default.ini"))
+        CRT(config, "lrm", {}).is_exist_or_make()
+        crt = CRT(config, "lrm", sessions)
+        crt.run()
+    return {
+        "stats": crt.stats,
+        "errors": crt.error_count + len(crt.errors),
+        "elapsed": time.perf_counter() - start_time,
+    }
+
+
+class Batch:
+    """
+    Generate LRM session trees for a list of users, e.g. to stage them on a shared drive.
+    1. Every user's reservations are fetched by threads sharing one HTTP session.
+    2. Devices in more than one user's reservations are turned into sessions only once.
+    3. Each user's tree is written by a worker process.
+    """
+
+    def __init__(self, config: dict, get_url):
+        self.config = config
+        self.get_url = get_url
+        batch = config.get("batch") or {}
+        self.users = batch.get("users") or []
+        self.workers = batch.get("workers") or os.cpu_count() or 1
+        self.template = batch.get("template") or os.path.join(
+            config["crt_path"] or "", "Default.ini"
+        )
+        self.fetcher = Fetcher(
+            config["cache_dir"],
+            HEADERS,
+            timeout=config["lrm"].get("timeout") or 10,
+        )
+        self.results = {}
+
+    def get_user_config(self, user: dict) -> dict:
+        config = copy.deepcopy(self.config)
+        config["cache_dir"] = os.path.join(self.config["cache_dir"], "batch", user["user"])
+        if (config.get("output") or {}).get("backend", "ini") in (None, "ini"):
+            config["crt_path"] = user["path"]
+        else:
+            config["crt_path"] = None
+            config["output"]["path"] = user["path"]
+        if user.get("username") != None:
+            config["lrm"]["username"] = user["username"]
+        if user.get("password") != None:
+            config["lrm"]["password"] = user["password"]
+        return config
+
+    @tracer.traced("batch.run")
+    def run(self) -> None:
+        if len(self.users) == 0:
+            raise Exception("[Error] No users in 'batch.users' of config.yml.")
+        is_ini = (self.config.get("output") or {}).get("backend", "ini") in (None, "ini")
+        if is_ini == True and os.path.exists(self.template) == False:
+            raise Exception(f"[Error] Session template '{self.template}' not found.")
+        start_time = time.perf_counter()
+        lrms = {}
+        for user in self.users:
+            lrms[user["user"]] = LRM(
+                self.get_url(user["user"]), self.get_user_config(user), self.fetcher
+            )
+            self.results[user["user"]] = {"status": "ok", "devices": None, "sessions": None}
+        rows = self.fetch(lrms)
+        trees = self.get_trees(lrms, rows)
+        self.render(lrms, trees)
+        self.report(time.perf_counter() - start_time)
+
+    @tracer.traced("batch.fetch")
+    def fetch(self, lrms: dict) -> dict:
+        """
+        Return {user: rows} of the users whose reservations have to be written.
+        """
+        rprint(f"Fetching devices of [green]{len(lrms)}[/green] user(s) from LRM...")
+
+        def fetch_user(user):
+            lrm = lrms[user]
+            start_time = time.perf_counter()
+            # Unchanged reservations are still synced, like LRM.run() does.
+            _, body = self.fetcher.get(lrm.url)
+            self.results[user]["fetch"] = time.perf_counter() - start_time
+            with tracer.span("lrm.parse", user=user):
+                return json.loads(body)["rows"]
+
+        rows = {}
+        with ThreadPoolExecutor(max_workers=min(8, len(lrms))) as executor:
+            futures = {user: executor.submit(fetch_user, user) for user in lrms}
+            for user, future in futures.items():
+                try:
+                    rows[user] = future.result()
+                except Exception as e:
+                    self.results[user].update(status="failed", error=repr(e))
+        return rows
+
+    @tracer.traced("batch.get_trees")
+    def get_trees(self, lrms: dict, rows: dict) -> dict:
+        """
+        Return {user: sessions} in the form of LRM.get_sessions().
+        A device shared by several users is filtered and turned into sessions once.
+        """
+        derived = {}
+        trees = {}
+        total = 0
+        for user, devices in rows.items():
+            lrm = lrms[user]
+            sessions = {}
+            for device in devices:
+                key = json.dumps(device, sort_keys=True)
+                if key not in derived:
+                    derived[key] = (
+                        []
+                        if lrm.is_filtered(device) == True
+                        else list(lrm.iter_device_sessions(device))
+                    )
+                for dir_name, session in derived[key]:
+                    sessions.setdefault(dir_name, []).append(session)
+            trees[user] = sessions
+            total += len(devices)
+            self.results[user]["devices"] = len(devices)
+            self.results[user]["sessions"] = sum(len(value) for value in sessions.values())
+        rprint(
+            f"Loaded [green]{total}[/green] device(s), [green]{len(derived)}[/green] unique."
+        )
+        return trees
+
+    @tracer.traced("batch.render")
+    def render(self, lrms: dict, trees: dict) -> None:
+        rprint(f"Writing session trees of [green]{len(trees)}[/green] user(s)...")
+
+        def done(user, result):
+            self.results[user].update(result)
+            if result["errors"] != 0:
+                written = sum(result["stats"].values()) - result["stats"]["deleted"]
+                status = "ok" if written != 0 else "failed"
+                self.results[user]["status"] = f"{status} ({result['errors']} errors)"
+            # Cache the response only once the user's tree is written.
+            self.fetcher.save(lrms[user].url)
+
+        def fail(user, e):
+            self.results[user].update(status="failed", error=repr(e))
+
+        tasks = [
+            (user, lrms[user].config, sessions, self.template)
+            for user, sessions in trees.items()
+        ]
+        if self.workers == 1 or len(tasks) <= 1:
+            for user, config, sessions, template in tasks:
+                try:
+                    done(user, render_tree(config, sessions, template))
+                except Exception as e:
+                    fail(user, e)
+            return
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as executor:
+            futures = {
+                user: executor.submit(render_tree, config, sessions, template)
+                for user, config, sessions, template in tasks
+            }
+            for user, future in futures.items():
+                try:
+                    done(user, future.result())
+                except Exception as e:
+                    fail(user, e)
+
+    def report(self, elapsed: float) -> None:
+        from rich.table import Table
+
+        table = Table(title="Batch")
+        for column in ("User", "Status", "Devices", "Sessions", "Created", "Updated", "Deleted"):
+            table.add_column(column, justify="left" if column in ("User", "Status") else "right")
+        for column in ("Fetch (s)", "Write (s)", "Sessions/s"):
+            table.add_column(column, justify="right")
+        total_sessions = 0
+        for user, result in self.results.items():
+            stats = result.get("stats") or {}
+            write = result.get("elapsed")
+            total_sessions += result["sessions"] if write != None else 0
+            table.add_row(
+                user,
+                result["status"],
+                str(result["devices"]) if result["devices"] != None else "-",
+                str(result["sessions"]) if result["sessions"] != None else "-",
+                str(stats.get("created", "-")),
+                str(stats.get("updated", "-")),
+                str(stats.get("deleted", "-")),
+                f"{result['fetch']:.2f}" if "fetch" in result else "-",
+                f"{write:.2f}" if write != None else "-",
+                f"{result['sessions'] / write:.0f}" if write else "-",
+            )
+        rprint(table)
+        rprint(
+            f"[green]{total_sessions}[/green] session(s) of [green]{len(self.results)}[/green] user(s) in [green]{elapsed:.2f}s[/green] ([green]{total_sessions / elapsed:.0f}[/green] sessions/s)"
+        )
+        for user, result in self.results.items():
+            if result["status"] == "failed":
+                rprint(f"[dark_orange][Error] {user}: {result['error']}[/dark_orange]")
@@ -0,0 +1,45 @@
+# standard library
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CredentialCache:
+    """
+    Per-run cache of 'Password V2' blobs.
+    A run only uses a few distinct passwords, so each one is encrypted once and reused for every session.
+    Both directions are kept in bounded LRU maps and must be cleared when the run ends.
+    """
+
+    def __init__(self, encrypt, decrypt, maxsize=16):
+        self.encrypt_func = encrypt
+        self.decrypt_func = decrypt
+        self.maxsize = maxsize
+        self.encrypted = OrderedDict()
+        self.decrypted = OrderedDict()
+        self.lock = threading.Lock()
+
+    def encrypt(self, password: str) -> str:
+        # Key by digest so plaintext passwords are not kept as dictionary keys.
+        key = hashlib.sha256(password.encode("utf-8")).digest()
+        return self.get(self.encrypted, key, lambda: self.encrypt_func(password))
+
+    def decrypt(self, encrypted: str) -> str:
+        return self.get(self.decrypted, encrypted, lambda: self.decrypt_func(encrypted))
+
+    def get(self, store, key, compute):
+        # Sessions are rendered on several threads.
+        with self.lock:
+            if key in store:
+                store.move_to_end(key)
+                return store[key]
+            value = compute()
+            store[key] = value
+            if len(store) > self.maxsize:
+                store.popitem(last=False)
+            return value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.encrypted.clear()
+            self.decrypted.clear()
@@ -1,16 +1,26 @@
 # standard library
 import os
 import shutil
+import hashlib
 
 # 3rd party packages
 from rich import print as rprint
-from Crypto.Hash import SHA256
-from Crypto.Cipher import AES
+
+# local modules
+from util.template import SessionTemplate
+from util.credential import CredentialCache
+from util.folder import FolderData
+from util.archive import Archive
+from util.writer import ParallelWriter
+from util.manifest import Manifest
+from util.backend import get_backend
+from util.timing import tracer
 
 
 class CRT:
     def __init__(self, config, kind, sessions, is_jh=False):
-        self.path = config["crt_path"]
+        # SecureCRT's session directory is not needed, and may not exist, for the single-file backends.
+        self.path = config["crt_path"] or ""
         self.top_dir = config["directory"][kind]["top"]
         self.sub_dir = config["directory"][kind]["sub"]
         self.old_dir = config["directory"][kind]["old"]
@@ -24,24 +34,60 @@ class CRT:
         self.adpassword = config["vmm"]["adpassword"]
         self.username = config[kind]["username"]
         self.password = config[kind]["password"]
+        self.sync_mode = config.get("sync_mode", "incremental")
+        self.cache_dir = config["cache_dir"]
+        self.archive_policy = config.get("archive")
         self.sessions = sessions
+        self.template = None
+        self.stats = {"created": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        self.created_dirs = 0
+        self.folder_data = {}
+        self.writer = ParallelWriter(config.get("write_workers") or 8)
+        self.errors = []
+        # Number of errors reported so far. report_errors() clears self.errors.
+        self.error_count = 0
+        # Directories whose source could not be fetched this time. Kept as they are instead of expired.
+        self.kept_dirs = set()
+        self.credentials = CredentialCache(self.encrypt_pass, self.decrypt_pass)
+        self.backend = get_backend(config, kind)
+        self.manifest = None
+        if self.backend == None:
+            self.manifest = Manifest(
+                self.sub_path, self.cache_dir, "manifest_jh" if is_jh == True else "manifest"
+            )
 
+    @tracer.traced("crt.run")
     def run(self) -> None:
         """
         1. Compare between existing directories and fetched comment.
         2. Move to the old directory if there is no the same comment-named directory. (recognizing it was expired)
-        3. Remove all directories in the sub-path except the 'old' directory.
-        4. Make directories and sessions.
+        3. Sync directories and sessions with fetched ones. Only what actually changed is created, updated or deleted.
+           (If 'sync_mode' is 'rebuild', make all directories again in a staging directory and switch it with the current one.)
+        In 'incremental' mode, 3 runs before 1-2 so that bundles can also be synced one by one with sync_bundle().
+        If an output backend other than 'ini' is configured, all sessions are exported to its single file instead.
         """
-        exist_dirs = self.get_exist_dirs(self.sub_path)
-        self.check_expire_and_move(exist_dirs, self.sessions)
-        self.remove_dir()
-        self.make_dir()
+        try:
+            if self.backend != None:
+                self.export()
+                return
+            if self.sync_mode == "rebuild":
+                self.recover_dir()
+                exist_dirs = self.get_exist_dirs(self.sub_path)
+                self.check_expire_and_move(exist_dirs, self.sessions)
+                self.rebuild_dir()
+                self.flush_folder_data()
+                self.manifest.save()
+            else:
+                self.sync_dir()
+        finally:
+            self.credentials.clear()
 
     def is_exist_or_make(self) -> None:
         """
         Check if directories existing. If not, make directory.
         """
+        if self.backend != None:
+            return
         rprint(f"Checking directories exist for {self.sub_dir}...")
 
         if os.path.exists(self.path) == False:
@@ -86,119 +132,481 @@ class CRT:
                     exist_dirs.append(entry.name)
         return exist_dirs
 
-    def check_expire_and_move(self, exist, sessions) -> None:
+    def get_exist_sessions(self, target_dir) -> list:
+        exist_sessions = []
+        with os.scandir(target_dir) as entries:
+            for entry in entries:
+                if (
+                    entry.is_file()
+                    and entry.name.endswith(".ini")
+                    and entry.name != "__FolderData__.ini"
+                ):
+                    exist_sessions.append(entry.name)
+        return exist_sessions
+
+    @tracer.traced("crt.check_expire_and_move")
+    def check_expire_and_move(self, exist, sessions) -> int:
         expired = list(
-            set(exist) - set(sessions) - set([self.old_dir]) - set([self.jh_dir])
+            set(exist)
+            - set(sessions)
+            - set([self.old_dir])
+            - set([self.jh_dir])
+            - self.kept_dirs
         )
+        archive = Archive(self.old_path, self.cache_dir, self.archive_policy)
         if len(expired) != 0:
             rprint(
                 f"Found [dark_orange]{len(expired)}[/dark_orange] expired reservation(s). Moving to '{self.old_dir}' directory..."
             )
             for dir in expired:
-                expired_dir = os.path.join(self.sub_path, dir)
-                to_be = os.path.join(self.old_path, dir)
-                if os.path.exists(to_be) == False:
-                    shutil.move(expired_dir, self.old_path)
-                else:
-                    while True:
-                        dir = dir + "_dup"
-                        to_be = os.path.join(self.old_path, dir)
-                        if os.path.exists(to_be) == False:
-                            shutil.move(expired_dir, to_be)
-                            break
-                self.edit_folder_data(self.sub_path)
+                name = archive.assign_name(dir)
+                shutil.move(
+                    os.path.join(self.sub_path, dir), os.path.join(self.old_path, name)
+                )
+                archive.add(name, dir)
+                self.get_folder_data(self.sub_path).remove(dir)
+                self.get_folder_data(self.old_path).add(name)
             print("Done.")
         else:
             print("No expired reservation(s).")
+        evicted = archive.evict()
+        if len(evicted) != 0:
+            rprint(
+                f"Evicted [dark_orange]{len(evicted)}[/dark_orange] old reservation(s) from '{self.old_dir}' directory."
+            )
+            for name in evicted:
+                self.get_folder_data(self.old_path).remove(name)
+        archive.save()
+        return len(expired)
+
+    def get_folder_data(self, path) -> FolderData:
+        if path not in self.folder_data:
+            self.folder_data[path] = FolderData(path)
+        return self.folder_data[path]
+
+    @tracer.traced("crt.flush_folder_data")
+    def flush_folder_data(self) -> None:
+        for folder_data in self.folder_data.values():
+            folder_data.flush()
+
+    @tracer.traced("crt.rebuild_dir")
+    def rebuild_dir(self):
+        """
+        Build the whole sub-tree in a staging directory next to the sub directory, then switch them with renames.
+        SecureCRT sees either the previous tree or the new one, never a half-built one.
+        """
+        stage_path = os.path.join(self.top_path, f".{self.sub_dir}.staging")
+        backup_path = os.path.join(self.top_path, f".{self.sub_dir}.backup")
+        if os.path.exists(stage_path):
+            shutil.rmtree(stage_path)
+        os.mkdir(stage_path)
+        self.make_dir(stage_path)
+
+        # Everything except the session directories is carried over to the new tree.
+        # It is moved once the previous tree is out of sight, so neither tree is ever seen without it.
+        moved = []
+        try:
+            os.rename(self.sub_path, backup_path)
+            with os.scandir(backup_path) as entries:
+                kept = [entry.name for entry in entries if self.is_carried_over(entry)]
+            for name in kept:
+                os.rename(os.path.join(backup_path, name), os.path.join(stage_path, name))
+                moved.append(name)
+            os.rename(stage_path, self.sub_path)
+        except OSError:
+            # e.g. a file in the tree is locked on Windows. Put things back as they were.
+            for name in moved:
+                os.rename(os.path.join(stage_path, name), os.path.join(backup_path, name))
+            if os.path.exists(backup_path):
+                os.rename(backup_path, self.sub_path)
+            shutil.rmtree(stage_path)
+            raise
+        shutil.rmtree(backup_path)
+        self.folder_data[self.sub_path] = FolderData(self.sub_path)
+
+    def is_carried_over(self, entry) -> bool:
+        return (
+            not entry.is_dir()
+            or entry.name in (self.old_dir, self.jh_dir)
+            or entry.name in self.kept_dirs
+        )
 
-    def edit_folder_data(self, path) -> None:
-        """
-        Temporary code.
-        Sometimes certain directories remain with ini file even though moving to old directory.
-        If not resolve with this code, restarting SecureCRT is needed.
-        """
-        edit_list = ":".join(self.get_exist_dirs(path)) + ":"
-        ini = os.path.join(path, "__FolderData__.ini")
-        new_content = ""
-        with open(ini, "r", encoding="UTF-8") as f:
-            lines = f.readlines()
-            for line in lines:
-                if 'S:"Folder List"=' in line:
-                    line = f'S:"Folder List"={edit_list}\n'
-                new_content += line
-        with open(ini, "w", encoding="UTF-8") as f:
-            f.write(new_content)
-
-    def remove_dir(self):
-        dirs = self.get_exist_dirs(self.sub_path)
-        targets = list(set(dirs) - set([self.old_dir]) - set([self.jh_dir]))
-        for target in targets:
-            shutil.rmtree(os.path.join(self.sub_path, target))
-        self.edit_folder_data(self.sub_path)
-
-    def make_dir(self):
-        bundles = self.sessions
-        session_num = 0
+    def recover_dir(self):
+        """
+        Clean up what an interrupted rebuild_dir() left behind.
+        """
+        stage_path = os.path.join(self.top_path, f".{self.sub_dir}.staging")
+        backup_path = os.path.join(self.top_path, f".{self.sub_dir}.backup")
+        if os.path.exists(backup_path):
+            if os.path.exists(self.sub_path) == False:
+                # Interrupted before the switch. Keep the previous tree.
+                os.rename(backup_path, self.sub_path)
+            else:
+                shutil.rmtree(backup_path)
+        if os.path.exists(stage_path):
+            # Entries carried over from the sub directory may already be in the staging directory.
+            with os.scandir(stage_path) as entries:
+                for entry in entries:
+                    to_be = os.path.join(self.sub_path, entry.name)
+                    if self.is_carried_over(entry) == True and os.path.exists(to_be) == False:
+                        os.rename(entry.path, to_be)
+            shutil.rmtree(stage_path)
+
+    @tracer.traced("crt.make_dir")
+    def make_dir(self, base_path=None):
+        base_path = base_path or self.sub_path
+        bundles = list(self.sessions)
+        dir_paths = [(os.path.join(base_path, bundle),) for bundle in bundles]
+        for _, error in self.writer.map(os.mkdir, dir_paths):
+            if error != None:
+                raise error
+        tasks = []
         for bundle in bundles:
-            new_dir_path = os.path.join(self.sub_path, bundle)
-            os.mkdir(new_dir_path)
-            session_num += self.add_sessions(new_dir_path, bundle)
+            for session in self.sessions[bundle]:
+                tasks.append((os.path.join(base_path, bundle), session))
+        session_num = self.write_sessions(tasks)
         rprint(f"[green]All sessions have been created![/green]")
         rprint(f" - Directories: [green]{len(bundles)}[/green]")
         rprint(f" - Sessions: [green]{session_num}[/green]")
+        self.report_errors()
+
+    def sync_dir(self):
+        """
+        Reconcile directories and sessions on disk with fetched sessions.
+        Directories and session files that are already up to date are left untouched.
+        """
+        self.sync_bundles(list(self.sessions))
+        self.finish_sync()
+
+    def sync_bundle(self, bundle, sessions=None):
+        """
+        Sync a single bundle. Sessions can be given here when bundles arrive one by one.
+        """
+        if sessions != None:
+            self.sessions[bundle] = sessions
+        if self.backend != None:
+            return
+        self.sync_bundles([bundle])
+
+    @tracer.traced("crt.sync_bundles")
+    def sync_bundles(self, bundles):
+        """
+        Directories are prepared and sessions are synced on the writer's threads.
+        Results are reported in the order of bundles and sessions, so the output is deterministic.
+        """
+        exist = self.prepare_bundle_dirs(bundles)
+        tasks = []
+        for bundle in bundles:
+            if bundle in exist:
+                for session in self.sessions[bundle]:
+                    tasks.append((bundle, session, exist[bundle]))
+        self.sync_sessions(tasks)
+        for bundle in bundles:
+            if bundle in exist:
+                wanted = set(session.file_name for session in self.sessions[bundle])
+                self.remove_sessions(bundle, exist[bundle] - wanted)
+
+    def sync_stream(self, items, batch_size=256):
+        """
+        Sync (dir_name, session) pairs as they arrive, in batches of batch_size.
+        Only file names are kept in memory, and stale sessions are removed once the stream ends.
+        The single-file backends need every session to write their file, so they are kept in that case.
+        """
+        if self.backend != None:
+            for bundle, session in items:
+                self.sessions.setdefault(bundle, []).append(session)
+            self.export()
+            return
+        exist = {}
+        wanted = {}
+        batch = []
+
+        def flush_batch():
+            new_bundles = [bundle for bundle in dict.fromkeys(b for b, _ in batch) if bundle not in exist]
+            exist.update(self.prepare_bundle_dirs(new_bundles))
+            self.sync_sessions(
+                [(bundle, session, exist[bundle]) for bundle, session in batch if bundle in exist]
+            )
+            batch.clear()
+
+        for bundle, session in items:
+            if bundle not in wanted:
+                wanted[bundle] = set()
+                self.sessions[bundle] = []
+            wanted[bundle].add(session.file_name)
+            batch.append((bundle, session))
+            if len(batch) >= batch_size:
+                flush_batch()
+        flush_batch()
+        for bundle in wanted:
+            if bundle in exist:
+                self.remove_sessions(bundle, exist[bundle] - wanted[bundle])
+        self.finish_sync()
+
+    def prepare_bundle_dirs(self, bundles) -> dict:
+        """
+        Make missing bundle directories and list their existing sessions.
+        Return {bundle: set(existing session file names)} for the bundles that are ready.
+        """
+
+        def prepare(bundle):
+            dir_path = os.path.join(self.sub_path, bundle)
+            if os.path.isdir(dir_path):
+                return False, set(self.get_exist_sessions(dir_path))
+            os.mkdir(dir_path)
+            return True, set()
+
+        exist = {}
+        results = self.writer.map(prepare, [(bundle,) for bundle in bundles])
+        for bundle, (result, error) in zip(bundles, results):
+            if error != None:
+                self.errors.append((os.path.join(self.sub_path, bundle), error))
+                continue
+            is_created, exist[bundle] = result
+            if is_created == True:
+                self.get_folder_data(self.sub_path).add(bundle)
+                self.created_dirs += 1
+        return exist
+
+    @tracer.traced("crt.finish_sync")
+    def finish_sync(self):
+        """
+        Move expired directories once every bundle is known, then report.
+        """
+        if self.backend != None:
+            self.export()
+            return
+        exist_dirs = self.get_exist_dirs(self.sub_path)
+        expired_num = self.check_expire_and_move(exist_dirs, self.sessions)
+        self.flush_folder_data()
+        self.manifest.save()
+        stats = self.stats
+        rprint(f"[green]All sessions have been synchronized![/green]")
+        rprint(
+            f" - Directories: [green]{self.created_dirs}[/green] created, [green]{expired_num}[/green] expired, [green]{len(self.sessions) - self.created_dirs}[/green] kept"
+        )
+        rprint(
+            f" - Sessions: [green]{stats['created']}[/green] created, [green]{stats['updated']}[/green] updated, [green]{stats['deleted']}[/green] deleted, [green]{stats['unchanged']}[/green] unchanged"
+        )
+        self.report_errors()
+
+    @tracer.traced("crt.export")
+    def export(self, jh_crt=None):
+        """
+        Write all sessions, and the jumphost's ones if given, to the output backend at once.
+        """
+        entries = self.get_entries()
+        if jh_crt != None:
+            entries = jh_crt.get_entries() + entries
+        path = self.backend.write(entries, self.credentials.encrypt)
+        rprint(f"[green]All sessions have been exported![/green]")
+        rprint(f" - Sessions: [green]{len(entries)}[/green]")
+        rprint(f" - File: [green]{path}[/green]")
+
+    def get_entries(self) -> list:
+        username = self.adusername if self.is_jh == True else self.username
+        password = self.get_password()
+        entries = []
+        for bundle, sessions in self.sessions.items():
+            for session in sessions:
+                entry = {
+                    "folder": [self.top_dir, self.sub_dir, bundle],
+                    "name": os.path.splitext(session.file_name)[0],
+                    "session": session,
+                    "username": username,
+                    "password": password or None,
+                    "firewall": None,
+                }
+                if self.has_jh == True and session.jumphost != None:
+                    entry["firewall"] = "/".join(
+                        [self.top_dir, self.sub_dir, self.jh_dir, session.jumphost]
+                    )
+                entries.append(entry)
+        return entries
+
+    def report_errors(self):
+        if len(self.errors) == 0:
+            return
+        rprint(
+            f"[dark_orange][Error] Failed to create {len(self.errors)} session(s) or directory(s).[/dark_orange]"
+        )
+        for path, error in self.errors:
+            rprint(f"[dark_orange] - {path}: {error}[/dark_orange]")
+        self.error_count += len(self.errors)
+        self.errors.clear()
+
+    def sync_sessions(self, tasks):
+        """
+        tasks = [(bundle, session, existing session file names of the bundle), ...]
+        """
+        results = self.writer.map(self.sync_session, tasks)
+        for (bundle, session, _), (status, error) in zip(tasks, results):
+            if error != None:
+                self.errors.append((os.path.join(bundle, session.file_name), error))
+                continue
+            if status == "created":
+                rprint(f" + {bundle}/{session.file_name}")
+            if status == "updated":
+                rprint(f" * {bundle}/{session.file_name}")
+            self.stats[status] += 1
+
+    def sync_session(self, bundle, session, exist_sessions) -> str:
+        """
+        Return "created", "updated" or "unchanged".
+        A session recorded in the manifest with the same hash is not read at all.
+        Otherwise it is compared line by line, so files changed outside of the tool are still detected.
+        """
+        session_ini = os.path.join(self.sub_path, bundle, session.file_name)
+        digest = self.get_digest(session)
+        if session.file_name not in exist_sessions:
+            status = "created"
+        elif self.manifest.is_same(session_ini, digest):
+            return "unchanged"
+        elif self.is_same_session(session_ini, self.render_session(session)):
+            self.manifest.record(session_ini, digest)
+            return "unchanged"
+        else:
+            status = "updated"
+        self.write_session(session_ini, self.render_session(session))
+        self.manifest.record(session_ini, digest)
+        return status
+
+    def remove_sessions(self, bundle, file_names):
+        for file_name in sorted(file_names):
+            os.remove(os.path.join(self.sub_path, bundle, file_name))
+            rprint(f" - {bundle}/{file_name}")
+            self.stats["deleted"] += 1
+
+    def is_same_session(self, session_ini, new_content) -> bool:
+        """
+        Compare the existing session file with newly rendered content.
+        'Password V2' is salted with random padding, so it is compared after decrypting.
+        """
+        with tracer.span("crt.read"):
+            with open(session_ini, "r", encoding="UTF-8") as f:
+                old_content = f.read()
+        tracer.count("crt.files_read")
+        tracer.count("crt.bytes_read", len(old_content))
+        old_lines = old_content.splitlines()
+        new_lines = new_content.splitlines()
+        if len(old_lines) != len(new_lines):
+            return False
+        for old_line, new_line in zip(old_lines, new_lines):
+            if old_line == new_line:
+                continue
+            prefix = 'S:"Password V2"=02:'
+            if not (old_line.startswith(prefix) and new_line.startswith(prefix)):
+                return False
+            try:
+                if self.credentials.decrypt(
+                    old_line[len(prefix) :]
+                ) != self.credentials.decrypt(new_line[len(prefix) :]):
+                    return False
+            except ValueError:
+                return False
+        return True
 
+    @tracer.traced("crt.add_sessions")
     def add_sessions(self, dir_path, bundle_name):
         rprint(f"Creating sessions for {bundle_name}...")
+        success = self.write_sessions(
+            [(dir_path, session) for session in self.sessions[bundle_name]]
+        )
+        self.manifest.save()
+        self.report_errors()
+        return success
+
+    def write_sessions(self, tasks) -> int:
+        """
+        tasks = [(dir_path, session), ...]
+        Render and write every session on the writer's threads. A failed session does not stop the others.
+        Sessions already holding the same content by the manifest are not written again.
+        """
+
+        def write(dir_path, session):
+            session_ini = os.path.join(dir_path, session.file_name)
+            # Sessions may be written in a staging directory. Record them where they end up.
+            key = f"{os.path.basename(dir_path)}/{session.file_name}"
+            digest = self.get_digest(session)
+            if self.manifest.is_same(session_ini, digest, key):
+                return False
+            self.write_session(session_ini, self.render_session(session))
+            self.manifest.record(session_ini, digest, key)
+            return True
+
         success = 0
-        try:
-            for session in self.sessions[bundle_name]:
-                new_content = ""
-                org_default_ini = os.path.join(self.path, "Default.ini")
-                new_default_ini = os.path.join(dir_path, "Default.ini")
-                session_ini = os.path.join(dir_path, session["file_name"])
-                shutil.copyfile(org_default_ini, new_default_ini)
-                shutil.move(new_default_ini, session_ini)
-                with open(session_ini, "r", encoding="UTF-8") as f:
-                    lines = f.readlines()
-                    for line in lines:
-                        if line.startswith('S:"Hostname"='):
-                            line = f'S:"Hostname"={session["host"]}\n'
-                        if 'S:"Username"=' in line:
-                            if self.is_jh == True:
-                                line = f'S:"Username"={self.adusername}\n'
-                            else:
-                                line = f'S:"Username"={self.username}\n'
-                        if line.startswith('S:"Password V2"='):
-                            if self.is_jh == True:
-                                line = f'S:"Password V2"=02:{self.encrypt_pass(self.adpassword)}\n'
-                            else:
-                                line = f'S:"Password V2"=02:{self.encrypt_pass(self.password)}\n'
-                        if line.startswith('D:"Session Password Saved"='):
-                            line = 'D:"Session Password Saved"=00000001\n'
-                        if line.startswith('S:"Protocol Name"='):
-                            line = f'S:"Protocol Name"={session["protocol"]}\n'
-                        if line.startswith('D:"Port"=') or line.startswith(
-                            'D:"[SSH2] Port"='
-                        ):
-                            if session["protocol"] == "SSH2":
-                                line = f'D:"[SSH2] Port"={int(session["port"]):08x}\n'
-                            else:
-                                line = f'D:"Port"={int(session["port"]):08x}\n'
-                        if self.has_jh == True and session["jumphost"] != None:
-                            if line.startswith('S:"Firewall Name"='):
-                                line = f'S:"Firewall Name"=Session:{os.path.join(self.top_dir, self.sub_dir, self.jh_dir, session["jumphost"])}\n'
-                        new_content += line
-                with open(session_ini, "w", encoding="UTF-8") as f:
-                    f.write(new_content)
-                rprint(f" - {session['file_name']}")
-                success += 1
-        except Exception:
-            rprint(
-                f"[dark_orange][Error] Failed to create {session['file_name']}.[/dark_orange]"
-            )
+        for (dir_path, session), (is_written, error) in zip(
+            tasks, self.writer.map(write, tasks)
+        ):
+            if error != None:
+                self.errors.append((os.path.join(dir_path, session.file_name), error))
+                continue
+            if is_written == True:
+                rprint(f" - {session.file_name}")
+                self.stats["created"] += 1
+            else:
+                self.stats["unchanged"] += 1
+            success += 1
         return success
 
+    def write_session(self, session_ini, content):
+        with tracer.span("crt.write"):
+            with open(session_ini, "w", encoding="UTF-8") as f:
+                f.write(content)
+        tracer.count("crt.files_written")
+        tracer.count("crt.bytes_written", len(content))
+
+    def render_session(self, session) -> str:
+        fields = self.get_fields(session)
+        if self.template.has("password"):
+            fields["password"] = f'S:"Password V2"=02:{self.credentials.encrypt(self.get_password())}\n'
+        return self.template.render(fields)
+
+    def get_digest(self, session) -> str:
+        """
+        Hash of the content render_session() makes. 'Password V2' is encrypted with random padding,
+        so the password itself is hashed in place of the line.
+        """
+        fields = self.get_fields(session)
+        digest = hashlib.sha256(self.template.digest.encode("utf-8"))
+        for key in sorted(fields):
+            digest.update(f"{key}={fields[key]}".encode("utf-8"))
+        if self.template.has("password"):
+            digest.update(f"password={self.get_password()}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_password(self) -> str:
+        return self.adpassword if self.is_jh == True else self.password
+
+    def get_fields(self, session) -> dict:
+        """
+        Lines to be replaced in Default.ini except 'Password V2'.
+        """
+        if self.template == None:
+            self.template = SessionTemplate.load(os.path.join(self.path, "Default.ini"))
+        username = self.adusername if self.is_jh == True else self.username
+        if session.protocol == "SSH2":
+            port = f'D:"[SSH2] Port"={session.port:08x}\n'
+        else:
+            port = f'D:"Port"={session.port:08x}\n'
+        fields = {
+            "hostname": f'S:"Hostname"={session.host}\n',
+            "username": f'S:"Username"={username}\n',
+            "password_saved": 'D:"Session Password Saved"=00000001\n',
+            "protocol": f'S:"Protocol Name"={session.protocol}\n',
+            "port": port,
+        }
+        if self.has_jh == True and session.jumphost != None:
+            fields[
+                "firewall"
+            ] = f'S:"Firewall Name"=Session:{os.path.join(self.top_dir, self.sub_dir, self.jh_dir, session.jumphost)}\n'
+        return fields
+
     def encrypt_pass(self, password):
+        # Crypto is only loaded when a 'Password V2' is made. The single-file backends may never need it.
+        from Crypto.Hash import SHA256
+        from Crypto.Cipher import AES
+
         iv = b"\x00" * AES.block_size
         key = SHA256.new("".encode("utf-8")).digest()
 
@@ -216,3 +624,17 @@ class CRT:
         )
         cipher = AES.new(key, AES.MODE_CBC, iv)
         return cipher.encrypt(padded_plain_bytes).hex()
+
+    def decrypt_pass(self, encrypted):
+        from Crypto.Hash import SHA256
+        from Crypto.Cipher import AES
+
+        iv = b"\x00" * AES.block_size
+        key = SHA256.new("".encode("utf-8")).digest()
+
+        cipher = AES.new(key, AES.MODE_CBC, iv)
+        plain_bytes = cipher.decrypt(bytes.fromhex(encrypted))
+        length = int.from_bytes(plain_bytes[:4], "little")
+        if length > len(plain_bytes) - 4 - SHA256.digest_size:
+            raise ValueError("Invalid encrypted password.")
+        return plain_bytes[4 : 4 + length].decode("utf-8")
@@ -0,0 +1,237 @@
+# standard library
+import os
+import json
+import codecs
+import hashlib
+
+# 3rd party packages
+import requests
+
+# local modules
+from util.timing import tracer
+
+
+class Fetcher:
+    """
+    HTTP GET on a pooled session with conditional requests and an on-disk cache of the last response.
+    get() returns (state, body) where state is one of
+     - "modified"     : new body from the server
+     - "not_modified" : the server answered 304, body is the cached one
+     - "cached"       : the server was slow or unreachable, body is the cached one
+    The new response is only persisted by save(), so a run that fails midway is fetched again next time.
+    One Fetcher can be shared by threads fetching different URLs, and they share its connections.
+    """
+
+    def __init__(self, cache_dir: str, headers=None, timeout=10):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        # {url: (meta, body)} of the responses not saved yet
+        self.pending = {}
+
+    def get_cache_path(self, url) -> str:
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"http_{name}")
+
+    def load(self, url):
+        meta = self.load_meta(url)
+        if meta == None:
+            return None, None
+        try:
+            with open(self.get_cache_path(url) + ".body", "rb") as f:
+                body = f.read()
+        except OSError:
+            return None, None
+        return meta, body
+
+    def load_meta(self, url):
+        cache_path = self.get_cache_path(url)
+        if os.path.exists(cache_path + ".body") == False:
+            return None
+        try:
+            with open(cache_path + ".json", "r", encoding="UTF-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_conditional_headers(self, meta) -> dict:
+        headers = {}
+        if meta != None:
+            if meta.get("etag") != None:
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified") != None:
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def get(self, url):
+        meta, body = self.load(url)
+        headers = self.get_conditional_headers(meta)
+        try:
+            with tracer.span("http.get", url=url):
+                res = self.session.get(url, headers=headers, timeout=self.timeout)
+        except (requests.Timeout, requests.ConnectionError):
+            if body == None:
+                raise
+            return "cached", body
+        if res.status_code == 304 and body != None:
+            return "not_modified", body
+        res.raise_for_status()
+        tracer.count("http.bytes", len(res.content))
+        self.pending[url] = (
+            {
+                "etag": res.headers.get("ETag"),
+                "last_modified": res.headers.get("Last-Modified"),
+            },
+            res.content,
+        )
+        return "modified", res.content
+
+    def stream(self, url, chunk_size=65536):
+        """
+        Same as get(), but the body is an iterator of chunks instead of bytes.
+        A new body is copied to the cache directory while it is consumed.
+        """
+        meta = self.load_meta(url)
+        headers = self.get_conditional_headers(meta)
+        cache_path = self.get_cache_path(url)
+        try:
+            with tracer.span("http.get", url=url, stream=True):
+                res = self.session.get(
+                    url, headers=headers, timeout=self.timeout, stream=True
+                )
+        except (requests.Timeout, requests.ConnectionError):
+            if meta == None:
+                raise
+            return "cached", self.iter_file(cache_path + ".body", chunk_size)
+        if res.status_code == 304 and meta != None:
+            res.close()
+            return "not_modified", self.iter_file(cache_path + ".body", chunk_size)
+        res.raise_for_status()
+        new_meta = {
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+        }
+        return "modified", self.iter_response(url, new_meta, res, chunk_size)
+
+    def iter_file(self, path, chunk_size):
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if len(chunk) == 0:
+                    break
+                yield chunk
+
+    def iter_response(self, url, meta, res, chunk_size):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with res, open(self.get_cache_path(url) + ".body.tmp", "wb") as f:
+            for chunk in res.iter_content(chunk_size):
+                f.write(chunk)
+                tracer.count("http.bytes", len(chunk))
+                yield chunk
+        # The body is already in '.body.tmp', so save() only has to rename it.
+        self.pending[url] = (meta, None)
+
+    def save(self, url=None) -> None:
+        """
+        Persist the pending response of url, or of every URL if it is None.
+        """
+        urls = list(self.pending) if url == None else [url]
+        for url in urls:
+            if url not in self.pending:
+                continue
+            meta, body = self.pending.pop(url)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            cache_path = self.get_cache_path(url)
+            if body != None:
+                with open(cache_path + ".body.tmp", "wb") as f:
+                    f.write(body)
+            with open(cache_path + ".json.tmp", "w", encoding="UTF-8") as f:
+                json.dump(meta, f)
+            os.replace(cache_path + ".body.tmp", cache_path + ".body")
+            os.replace(cache_path + ".json.tmp", cache_path + ".json")
+
+
+def iter_json_array(chunks, key):
+    """
+    Yield each element of the array under 'key' of the top-level object while reading the JSON document chunk by chunk.
+    Only one value is decoded at a time, so memory does not grow with the array.
+    Raise ValueError if the document ends early or has no such array, e.g. an error body.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    is_eof = False
+
+    def read_more():
+        nonlocal buffer, position, is_eof
+        chunk = next(chunks, None)
+        if chunk == None:
+            if is_eof == True:
+                raise ValueError(f"Unexpected end of the JSON document while reading '{key}'.")
+            is_eof = True
+            return
+        # Drop what has been decoded so the buffer stays small.
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+
+    def skip(characters):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            if position < len(buffer) or is_eof == True:
+                return
+            read_more()
+
+    def expect(character):
+        nonlocal position
+        skip(" \t\r\n")
+        if position == len(buffer) or buffer[position] != character:
+            raise ValueError(f"Expected '{character}' while looking for the '{key}' array.")
+        position += 1
+
+    def decode(delimiters):
+        nonlocal position
+        skip(" \t\r\n")
+        while True:
+            try:
+                if position == len(buffer):
+                    raise ValueError("Need more data.")
+                value, end = decoder.raw_decode(buffer, position)
+                # A number cut by the end of a chunk, e.g. '12' of '123' or '-7' of '-7.5', decodes too.
+                # Read on until the delimiter after the value is in the buffer to be sure it ended.
+                following = end
+                while following < len(buffer) and buffer[following] in " \t\r\n":
+                    following += 1
+                if is_eof == False and (
+                    following == len(buffer) or buffer[following] not in delimiters
+                ):
+                    raise ValueError("Need more data.")
+            except ValueError:
+                read_more()
+                continue
+            position = end
+            return value
+
+    # Find the array among the members of the top-level object, skipping the other values whole.
+    expect("{")
+    while True:
+        skip(" \t\r\n,")
+        if position < len(buffer) and buffer[position] == "}":
+            raise ValueError(f"No '{key}' array in the JSON document.")
+        name = decode(":")
+        expect(":")
+        if name == key:
+            expect("[")
+            break
+        decode(",}")
+
+    while True:
+        skip(" \t\r\n,")
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        yield decode(",]")
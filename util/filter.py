@@ -0,0 +1,79 @@
+# standard library
+import re
+
+# Fields each kind of record can be matched on.
+FIELDS = {
+    "lrm": ("name", "ip", "console", "comment"),
+    "vmm": ("pod", "name", "ip"),
+}
+
+
+class Filter:
+    """
+    Include/exclude rules compiled once into a single regex per field. A rule is one of
+     - "keyword"                 : matched anywhere in the record's line
+     - "re:pattern"              : regex searched in the record's line
+     - "field:keyword"           : matched in the field only
+     - "field:re:pattern"        : regex searched in the field only
+    Matching is case-insensitive. A record passes if it matches any include rule, or there is none,
+    and no exclude rule.
+    """
+
+    def __init__(self, fields, include=None, exclude=None):
+        self.fields = fields
+        self.include = self.compile_rules(include)
+        self.exclude = self.compile_rules(exclude)
+        self.is_empty = len(self.include) == 0 and len(self.exclude) == 0
+
+    def compile_rules(self, rules) -> dict:
+        """
+        Return {field: compiled regex}. The field of the rules matched on the whole line is None.
+        """
+        patterns = {}
+        for original in rules or []:
+            rule = str(original)
+            field = None
+            prefix, sep, rest = rule.partition(":")
+            if sep != "" and prefix in self.fields:
+                field, rule = prefix, rest
+            if rule.startswith("re:"):
+                pattern = f"(?:{rule[3:]})"
+                # Checked as it is joined with the others, e.g. a global flag like '(?i)' is an error there.
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise Exception(f"[Error] Invalid filter rule '{original}': {e}")
+            else:
+                pattern = f"(?:{re.escape(rule)})"
+            patterns.setdefault(field, []).append(pattern)
+        return {
+            field: re.compile("|".join(field_patterns), re.IGNORECASE)
+            for field, field_patterns in patterns.items()
+        }
+
+    def search(self, compiled, line, fields) -> bool:
+        for field, regex in compiled.items():
+            value = line if field == None else fields.get(field)
+            if value != None and regex.search(value) != None:
+                return True
+        return False
+
+    def match(self, line: str, **fields) -> bool:
+        if self.is_empty == True:
+            return True
+        if len(self.exclude) != 0 and self.search(self.exclude, line, fields) == True:
+            return False
+        if len(self.include) != 0 and self.search(self.include, line, fields) == False:
+            return False
+        return True
+
+
+def get_filter(config: dict, kind: str) -> Filter:
+    rules = (config.get("filter") or {}).get(kind) or {}
+    include = list(rules.get("include") or [])
+    exclude = list(rules.get("exclude") or [])
+    if kind == "vmm":
+        # 'vmm.keyword.exclude' is kept as plain keywords.
+        keywords = (config["vmm"].get("keyword") or {}).get("exclude") or []
+        exclude += ["re:" + re.escape(str(keyword)) for keyword in keywords]
+    return Filter(FIELDS[kind], include, exclude)
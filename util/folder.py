@@ -0,0 +1,53 @@
+# standard library
+import os
+
+
+class FolderData:
+    """
+    SecureCRT's __FolderData__.ini of a single directory, kept in memory during a run.
+    Sometimes certain directories remain in SecureCRT even though they were moved to the old directory,
+    unless 'Folder List' is rewritten to match the directories on the disk.
+    The folder list is taken from the disk once, updated in memory as directories are added, moved or removed,
+    and written once with flush().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ini = os.path.join(path, "__FolderData__.ini")
+        self.folders = []
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        self.folders.append(entry.name)
+
+    def add(self, name: str) -> None:
+        if name not in self.folders:
+            self.folders.append(name)
+
+    def remove(self, name: str) -> None:
+        if name in self.folders:
+            self.folders.remove(name)
+
+    def flush(self) -> None:
+        """
+        Rewrite 'Folder List' atomically. Nothing is written if it is already up to date,
+        or if SecureCRT has not made the file yet.
+        """
+        if os.path.exists(self.ini) == False:
+            return
+        folder_list = f'S:"Folder List"={":".join(self.folders)}:\n'
+        new_content = ""
+        is_changed = False
+        with open(self.ini, "r", encoding="UTF-8") as f:
+            for line in f:
+                if 'S:"Folder List"=' in line and line != folder_list:
+                    line = folder_list
+                    is_changed = True
+                new_content += line
+        if is_changed == False:
+            return
+        temp_ini = self.ini + ".tmp"
+        with open(temp_ini, "w", encoding="UTF-8") as f:
+            f.write(new_content)
+        os.replace(temp_ini, self.ini)
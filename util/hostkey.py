@@ -0,0 +1,122 @@
+# standard library
+import os
+import shutil
+
+# 3rd party packages
+import asyncssh
+from rich import print as rprint
+
+
+class HostKeyStore:
+    """
+    known_hosts loaded once per run and shared by every connection of the pool.
+     - Keys of hosts in known_hosts are verified by asyncssh as usual.
+     - A host not in known_hosts is trusted on the first handshake (like OpenSSH's 'accept-new'),
+       and its key is kept in memory, so it is never connected twice.
+     - A host whose key changed is trusted too, with a warning, and its old key is replaced,
+       as the key of the last connection was always written to known_hosts before.
+    Lines of known_hosts that cannot be parsed are skipped.
+    New keys are written to known_hosts in a single atomic write by save().
+    """
+
+    def __init__(self, path="~/.ssh/known_hosts"):
+        self.path = os.path.expanduser(path)
+        self.known_hosts = asyncssh.SSHKnownHosts()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="UTF-8", errors="replace") as f:
+                    lines = f.readlines()
+            except OSError as e:
+                rprint(f"[dark_orange][Error] Failed to read '{self.path}': {e}[/dark_orange]")
+                lines = []
+            self.known_hosts = asyncssh.import_known_hosts(
+                "".join(line for line in lines if self.parse(line) != None)
+            )
+        # {"host" or "[host]:port": SSHKey} learned in this run
+        self.new_keys = {}
+        self.pending = []
+        self.replaced = set()
+
+    def parse(self, line):
+        """
+        Return the line as SSHKnownHosts, or None if it is blank, a comment or invalid.
+        """
+        line = line.strip()
+        if len(line) == 0 or line.startswith("#"):
+            return None
+        try:
+            return asyncssh.import_known_hosts(line)
+        except (ValueError, asyncssh.KeyImportError):
+            return None
+
+    def get_name(self, host, port) -> str:
+        return host if port in (None, 22) else f"[{host}]:{port}"
+
+    def validate(self, host, addr, port, key) -> bool:
+        """
+        Called by asyncssh only when the key is not in known_hosts.
+        """
+        name = self.get_name(host, port)
+        if name in self.new_keys:
+            return self.new_keys[name] == key
+        # Known with other keys means the key changed.
+        if len(self.known_hosts.match(host, addr, None if port == 22 else port)[0]) != 0:
+            rprint(
+                f"[dark_orange][Warning] Host key of {name} changed. Replacing it in '{self.path}'.[/dark_orange]"
+            )
+            self.replaced.add(name)
+        self.new_keys[name] = key
+        self.pending.append(name)
+        return True
+
+    def make_client(self):
+        store = self
+
+        class Client(asyncssh.SSHClient):
+            def validate_host_public_key(self, host, addr, port, key):
+                return store.validate(host, addr, port, key)
+
+        return Client()
+
+    def is_replaced(self, line) -> bool:
+        """
+        Whether the line holds an old key of a host whose key is replaced. Patterns and markers are kept.
+        """
+        fields = line.split()
+        if len(fields) == 0 or fields[0].startswith("@") or any(c in fields[0] for c in "*?!"):
+            return False
+        known_hosts = self.parse(line)
+        if known_hosts == None:
+            return False
+        for name in self.replaced:
+            host, port = name, None
+            if name.startswith("["):
+                host, _, port = name[1:].partition("]:")
+                port = int(port)
+            if len(known_hosts.match(host, None, port)[0]) != 0:
+                return True
+        return False
+
+    def save(self) -> None:
+        if len(self.pending) == 0:
+            return
+        lines = []
+        for name in self.pending:
+            key = self.new_keys[name].export_public_key("openssh").decode("ascii").strip()
+            lines.append(f"{name} {key}\n")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Keep what was written to known_hosts meanwhile, e.g. by ssh.
+        content = ""
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="UTF-8", errors="replace") as f:
+                content = "".join(line for line in f if self.is_replaced(line) == False)
+            if len(content) != 0 and content.endswith("\n") == False:
+                content += "\n"
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="UTF-8") as f:
+            f.write(content + "".join(lines))
+        if os.path.exists(self.path):
+            shutil.copymode(self.path, temp_path)
+        os.replace(temp_path, self.path)
+        self.pending.clear()
+        self.replaced.clear()
@@ -1,59 +1,102 @@
 # standard library
 import re
+import json
 import ipaddress
 
 # 3rd party packages
-import requests
 from rich import print as rprint
 
 # local modules
-from util.type import SessionType
+from util.type import SessionType, Session
 from util.crt import CRT
+from util.fetch import Fetcher, iter_json_array
+from util.filter import get_filter
+from util.timing import tracer
+
+
+HEADERS = {"User-Agent": "Mozilla/5.0", "Content-Type": "application/json"}
 
 
 class LRM:
-    def __init__(self, url: str, config: dict):
+    def __init__(self, url: str, config: dict, fetcher=None):
         self.url = url
-        self.headers = {"User-Agent": "Mozilla/5.0", "Content-Type": "application/json"}
+        self.headers = dict(HEADERS)
         self.config = config
+        # A fetcher can be shared to reuse its connections, e.g. by Batch.
+        self.fetcher = fetcher or Fetcher(
+            config["cache_dir"],
+            self.headers,
+            timeout=config["lrm"].get("timeout") or 10,
+        )
+        self.filter = get_filter(config, "lrm")
+        self.filtered = 0
 
+    @tracer.traced("lrm.run")
     def run(self):
+        if self.config["lrm"].get("stream") == True:
+            self.run_stream()
+            return
         devices = self.get_lrm()
         sessions = self.get_sessions(devices)
         crt = CRT(self.config, "lrm", sessions)
         crt.run()
+        self.fetcher.save(self.url)
 
+    def run_stream(self):
+        """
+        Parse reservations from the response body incrementally and write each session as soon as it is derived.
+        Memory stays flat regardless of the number of devices.
+        """
+        rprint("Streaming devices from LRM...")
+        state, chunks = self.fetcher.stream(self.url)
+        self.print_state(state)
+        if state == "cached":
+            rprint(
+                "[dark_orange]LRM is not responding. Use the cached reservations.[/dark_orange]"
+            )
+        crt = CRT(self.config, "lrm", {})
+        try:
+            crt.sync_stream(self.iter_sessions(iter_json_array(chunks, "rows")))
+        finally:
+            crt.credentials.clear()
+        # Read the rest of the body after the array so that the whole response is cached.
+        for _ in chunks:
+            pass
+        self.fetcher.save(self.url)
+
+    @tracer.traced("lrm.get_lrm")
     def get_lrm(self):
         """
         Get reservations from LRM using API.
         """
         rprint("Fetching devices from LRM...")
-        res = requests.get(
-            self.url,
-            self.headers,
-        )
-        devices = res.json()["rows"]
+        state, body = self.fetcher.get(self.url)
+        self.print_state(state)
+        if state == "cached":
+            rprint(
+                "[dark_orange]LRM is not responding. Use the cached reservations.[/dark_orange]"
+            )
+        with tracer.span("lrm.parse"):
+            devices = json.loads(body)["rows"]
         rprint(f"Loaded [green]{len(devices)}[/green] device(s).")
         return devices
 
+    def print_state(self, state) -> None:
+        # The tree is still synced, since the session tree, Default.ini or config may have changed since the last run.
+        # The manifest keeps it cheap when nothing did.
+        if state == "not_modified":
+            rprint("No changes in LRM reservations. Checking sessions against the cached ones...")
+
+    @tracer.traced("lrm.get_sessions")
     def get_sessions(self, devices: dict):
         """
         Make session information to deliver in a given form like below.
         sessions = {
-            dir_name: [{
-                "type": ...,
-                "file_name": ...,
-                "host": ...,
-                "protocol": ...,
-                "port": ...,
-            },
-            {
-                "type": ...,
-                "file_name": ...,
-                "host": ...,
-                "protocol": ...,
-                "port": ...,
-            }, ...]
+            dir_name: [
+                Session(type, file_name, host, protocol, port, jumphost),
+                Session(type, file_name, host, protocol, port, jumphost),
+                ...
+            ]
         }
         """
         sessions = {}
@@ -64,86 +107,118 @@ class LRM:
             else:
                 sessions[dir_name] = [session]
 
+        for dir_name, session in self.iter_sessions(devices):
+            add_session(dir_name, session)
+        return sessions
+
+    def iter_sessions(self, devices):
+        """
+        Yield (dir_name, session) for each device one by one, so devices can also be given as a stream.
+        Devices not passing the filter are skipped.
+        """
+        self.filtered = 0
         for device in devices:
-            try:
-                is_re = "re0_"
-                has_re1 = True
-
-                rm_space = device["reservation"]["comment"].replace(" ", "")
-                dir_name = re.sub('[\/:*?"<>|]', "_", rm_space)
-
-                if (
-                    device["console_re1_ip_address"] == None
-                    or device["console_ip_address"] == device["console_re1_ip_address"]
-                ):
-                    has_re1 = False
-                    is_re = ""
-
-                # RE0 SSH
-                if device["mgt_ip_address"] != None:
-                    re0_ssh = (
-                        f"{device['name']}-{is_re}ssh_{device['mgt_ip_address']}.ini"
-                    )
-                    session = {
-                        "type": SessionType.RE0_SSH,
-                        "file_name": re0_ssh,
-                        "host": device["mgt_ip_address"],
-                        "protocol": "SSH2",
-                        "port": "22",
-                        "jumphost": None,
-                    }
-                    add_session(dir_name, session)
-
-                # RE0 Console
-                if (
-                    device["console_ip_address"] != None
-                    and len(device["console_ip_address"].split(":")) == 2
-                ):
-                    re0_con = f"{device['name']}-{is_re}console.ini"
-                    re0_console_ip = device["console_ip_address"].split(":")[0]
-                    re0_port = device["console_ip_address"].split(":")[1]
-                    session = {
-                        "type": SessionType.RE0_CON,
-                        "file_name": re0_con,
-                        "host": re0_console_ip,
-                        "protocol": "Telnet",
-                        "port": re0_port,
-                        "jumphost": None,
-                    }
-                    add_session(dir_name, session)
-
-                if has_re1 == True:
-                    # RE1 SSH
-                    # API not provide RE1 ip address. Add 1 to RE0's ip address according to consistency.
-                    re1_ip_address = format(
-                        ipaddress.ip_address(device["mgt_ip_address"]) + 1
-                    )
-                    re1_ssh = f"{device['name']}-re1_ssh_{re1_ip_address}.ini"
-                    session = {
-                        "type": SessionType.RE1_SSH,
-                        "file_name": re1_ssh,
-                        "host": re1_ip_address,
-                        "protocol": "SSH2",
-                        "port": "22",
-                        "jumphost": None,
-                    }
-                    add_session(dir_name, session)
-
-                    # RE1 Console
-                    re1_con = f"{device['name']}-re1_console.ini"
-                    re1_console_ip = device["console_re1_ip_address"].split(":")[0]
-                    re1_port = device["console_re1_ip_address"].split(":")[1]
-                    session = {
-                        "type": SessionType.RE1_CON,
-                        "file_name": re1_con,
-                        "host": re1_console_ip,
-                        "protocol": "Telnet",
-                        "port": re1_port,
-                        "jumphost": None,
-                    }
-                    add_session(dir_name, session)
-            except Exception:
-                rprint(
-                    f"[dark_orange][Error] Failed to get a device: {device['name']}[/dark_orange]"
+            if self.is_filtered(device) == True:
+                self.filtered += 1
+                continue
+            yield from self.iter_device_sessions(device)
+        if self.filtered != 0:
+            rprint(f"Filtered out [green]{self.filtered}[/green] device(s).")
+
+    def iter_device_sessions(self, device):
+        """
+        Yield (dir_name, session) of a device.
+        """
+        try:
+            is_re = "re0_"
+            has_re1 = True
+
+            rm_space = device["reservation"]["comment"].replace(" ", "")
+            dir_name = re.sub('[\/:*?"<>|]', "_", rm_space)
+
+            if (
+                device["console_re1_ip_address"] == None
+                or device["console_ip_address"] == device["console_re1_ip_address"]
+            ):
+                has_re1 = False
+                is_re = ""
+
+            # RE0 SSH
+            if device["mgt_ip_address"] != None:
+                re0_ssh = (
+                    f"{device['name']}-{is_re}ssh_{device['mgt_ip_address']}.ini"
                 )
-        return sessions
+                session = Session(
+                    type=SessionType.RE0_SSH,
+                    file_name=re0_ssh,
+                    host=device["mgt_ip_address"],
+                    protocol="SSH2",
+                    port=22,
+                    jumphost=None,
+                )
+                yield dir_name, session
+
+            # RE0 Console
+            if (
+                device["console_ip_address"] != None
+                and len(device["console_ip_address"].split(":")) == 2
+            ):
+                re0_con = f"{device['name']}-{is_re}console.ini"
+                re0_console_ip = device["console_ip_address"].split(":")[0]
+                re0_port = device["console_ip_address"].split(":")[1]
+                session = Session(
+                    type=SessionType.RE0_CON,
+                    file_name=re0_con,
+                    host=re0_console_ip,
+                    protocol="Telnet",
+                    port=re0_port,
+                    jumphost=None,
+                )
+                yield dir_name, session
+
+            if has_re1 == True:
+                # RE1 SSH
+                # API not provide RE1 ip address. Add 1 to RE0's ip address according to consistency.
+                re1_ip_address = format(
+                    ipaddress.ip_address(device["mgt_ip_address"]) + 1
+                )
+                re1_ssh = f"{device['name']}-re1_ssh_{re1_ip_address}.ini"
+                session = Session(
+                    type=SessionType.RE1_SSH,
+                    file_name=re1_ssh,
+                    host=re1_ip_address,
+                    protocol="SSH2",
+                    port=22,
+                    jumphost=None,
+                )
+                yield dir_name, session
+
+                # RE1 Console
+                re1_con = f"{device['name']}-re1_console.ini"
+                re1_console_ip = device["console_re1_ip_address"].split(":")[0]
+                re1_port = device["console_re1_ip_address"].split(":")[1]
+                session = Session(
+                    type=SessionType.RE1_CON,
+                    file_name=re1_con,
+                    host=re1_console_ip,
+                    protocol="Telnet",
+                    port=re1_port,
+                    jumphost=None,
+                )
+                yield dir_name, session
+        except Exception:
+            rprint(
+                f"[dark_orange][Error] Failed to get a device: {device['name']}[/dark_orange]"
+            )
+
+    def is_filtered(self, device) -> bool:
+        if self.filter.is_empty == True:
+            return False
+        fields = {
+            "name": device.get("name"),
+            "ip": device.get("mgt_ip_address"),
+            "console": device.get("console_ip_address"),
+            "comment": (device.get("reservation") or {}).get("comment"),
+        }
+        line = "\t".join(value for value in fields.values() if value != None)
+        return self.filter.match(line, **fields) == False
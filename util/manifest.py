@@ -0,0 +1,74 @@
+# standard library
+import os
+import json
+import hashlib
+import threading
+
+
+class Manifest:
+    """
+    Content hashes of the session files written by CRT under a directory.
+    manifest = {
+        "files": {"bundle/session.ini": {"hash": ..., "mtime_ns": ..., "size": ...}, ...},
+    }
+    A file is known to hold the recorded hash while its mtime and size are the ones recorded after writing it,
+    so unchanged sessions are skipped without reading them. Files changed outside of the tool fail this check.
+    Only the files recorded or confirmed during the run are kept when it is saved.
+    """
+
+    def __init__(self, root_path: str, cache_dir: str, name="manifest"):
+        self.root_path = root_path
+        key = hashlib.sha1(root_path.encode("utf-8")).hexdigest()
+        self.manifest_path = os.path.join(cache_dir, f"{name}_{key}.json")
+        self.files = {}
+        self.seen = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="UTF-8") as f:
+                    self.files = json.load(f)["files"]
+            except (ValueError, KeyError):
+                self.files = {}
+
+    def get_key(self, path: str) -> str:
+        return os.path.relpath(path, self.root_path).replace(os.sep, "/")
+
+    def is_same(self, path: str, digest: str, key=None) -> bool:
+        """
+        Return True if the file at path is known to hold content of the digest.
+        """
+        key = key or self.get_key(path)
+        entry = self.files.get(key)
+        if entry == None or entry["hash"] != digest:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_mtime_ns != entry["mtime_ns"] or stat.st_size != entry["size"]:
+            return False
+        with self.lock:
+            self.seen[key] = entry
+        return True
+
+    def record(self, path: str, digest: str, key=None) -> None:
+        """
+        Record the file at path right after it is written or confirmed to hold content of the digest.
+        key can be given when the file is written somewhere else first, like a staging directory.
+        """
+        stat = os.stat(path)
+        with self.lock:
+            self.seen[key or self.get_key(path)] = {
+                "hash": digest,
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+            }
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with self.lock:
+            with open(temp_path, "w", encoding="UTF-8") as f:
+                json.dump({"files": self.seen}, f)
+            self.files = dict(self.seen)
+        os.replace(temp_path, self.manifest_path)
@@ -0,0 +1,119 @@
+# standard library
+import asyncio
+
+# 3rd party packages
+import asyncssh
+
+# local modules
+from util.timing import tracer
+
+
+class ConnectionPool:
+    """
+    SSH connections kept open for a whole run, keyed by (host, jumphost).
+    The jumphost connection itself is pooled too, so every pod behind it shares one tunnel.
+    A fresh connection bypasses the pool, e.g. for a retry that should not wait on a stuck pooled one.
+    If ssh_config is given, hosts are resolved by that OpenSSH client config (HostName, Port, ...) instead of port 22.
+    Host keys are checked by host_keys (a HostKeyStore), or not at all if it is None.
+    Keepalives close a connection that died silently, e.g. while idle between refreshes of the watch mode,
+    so that it is dropped from the pool instead of being reused.
+    """
+
+    def __init__(
+        self,
+        username: str,
+        timeout=4,
+        ssh_config=None,
+        host_keys=None,
+        keepalive_interval=15,
+        keepalive_count_max=3,
+    ):
+        self.username = username
+        self.timeout = timeout
+        self.options = {"port": 22} if ssh_config == None else {"config": [ssh_config]}
+        self.options["keepalive_interval"] = keepalive_interval
+        self.options["keepalive_count_max"] = keepalive_count_max
+        if host_keys == None:
+            self.options["known_hosts"] = None
+        else:
+            self.options["known_hosts"] = host_keys.known_hosts
+            self.options["client_factory"] = host_keys.make_client
+        self.conns = {}
+        self.locks = {}
+        self.watchers = []
+        self.opened = 0
+        self.reused = 0
+
+    async def connect(self, host, password, jumphost=None, jumphost_password=None, fresh=False):
+        """
+        With fresh, open a connection (and tunnel) of its own that is not pooled. The caller closes it.
+        """
+        if fresh == True:
+            return await self.connect_fresh(host, password, jumphost, jumphost_password)
+        key = (host, jumphost)
+        if key not in self.locks:
+            self.locks[key] = asyncio.Lock()
+        async with self.locks[key]:
+            if key in self.conns:
+                self.reused += 1
+                return self.conns[key]
+            tunnel = None
+            if jumphost != None:
+                tunnel = await self.connect(jumphost, jumphost_password)
+            conn = await self.open(host, password, jumphost, tunnel)
+            self.conns[key] = conn
+            self.watchers.append(asyncio.ensure_future(self.forget(key, conn)))
+            return conn
+
+    async def connect_fresh(self, host, password, jumphost, jumphost_password):
+        tunnel = None
+        if jumphost != None:
+            tunnel = await self.open(jumphost, jumphost_password)
+        try:
+            conn = await self.open(host, password, jumphost, tunnel)
+        except BaseException:
+            if tunnel != None:
+                tunnel.close()
+            raise
+        if tunnel != None:
+            self.watchers.append(asyncio.ensure_future(self.close_tunnel(conn, tunnel)))
+        return conn
+
+    async def open(self, host, password, jumphost=None, tunnel=None):
+        with tracer.span("ssh.connect", host=host, jumphost=jumphost):
+            conn = await asyncio.wait_for(
+                asyncssh.connect(
+                    host,
+                    username=self.username,
+                    password=password,
+                    client_keys=None,
+                    tunnel=tunnel,
+                    **self.options,
+                ),
+                timeout=self.timeout,
+            )
+        self.opened += 1
+        return conn
+
+    async def close_tunnel(self, conn, tunnel):
+        await conn.wait_closed()
+        tunnel.close()
+        await tunnel.wait_closed()
+
+    async def forget(self, key, conn):
+        """
+        Drop the connection from the pool once it is closed by either side.
+        """
+        await conn.wait_closed()
+        if self.conns.get(key) is conn:
+            del self.conns[key]
+
+    async def close(self):
+        # Close pods first so tunnels are still alive while their channels shut down.
+        conns = sorted(self.conns.items(), key=lambda item: item[0][1] == None)
+        for _, conn in conns:
+            conn.close()
+            await conn.wait_closed()
+        await asyncio.gather(*self.watchers)
+        self.watchers.clear()
+        self.conns.clear()
@@ -0,0 +1,151 @@
+# standard library
+import time
+import random
+import asyncio
+
+# local modules
+from util.timing import tracer
+
+
+class PodResult:
+    """
+    status is one of
+     - "ok"      : value is what the fetch returned
+     - "failed"  : every attempt failed, error is the last one
+     - "timeout" : the deadline passed before any attempt succeeded
+    """
+
+    __slots__ = ("pod", "status", "value", "error", "attempts", "elapsed")
+
+    def __init__(self, pod, status, value=None, error=None, attempts=0, elapsed=0.0):
+        self.pod = pod
+        self.status = status
+        self.value = value
+        self.error = error
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    def __repr__(self) -> str:
+        return f"PodResult({self.pod!r}, {self.status!r}, attempts={self.attempts}, elapsed={self.elapsed:.2f})"
+
+
+class PodScheduler:
+    """
+    Fan out a coroutine over pods with
+     - at most 'concurrency' pods in flight
+     - a deadline per pod, covering all of its attempts
+     - retries with exponential backoff and jitter on the errors in retry_on, except the ones in fatal
+     - optionally, a hedged second attempt when the first one is slower than 'hedge_after' seconds.
+       Whichever finishes first wins and the other is cancelled.
+    The hedged attempt, and the retries after an error in reconnect_on, are told to use a fresh connection,
+    as the shared one may be what is stuck or broken.
+    Every pod gets a PodResult, so a pod that failed is never dropped silently.
+    """
+
+    def __init__(
+        self,
+        concurrency=8,
+        deadline=30,
+        retries=2,
+        backoff=0.5,
+        max_backoff=5,
+        hedge_after=None,
+        retry_on=(OSError, asyncio.TimeoutError),
+        fatal=(),
+        reconnect_on=(OSError, asyncio.TimeoutError),
+    ):
+        self.concurrency = max(1, concurrency)
+        self.deadline = deadline
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.retry_on = retry_on
+        self.fatal = fatal
+        self.reconnect_on = reconnect_on
+
+    async def run(self, pods, fetch, on_result=None) -> dict:
+        """
+        fetch(pod, fresh) is awaited for each attempt. on_result(result) is awaited as soon as each pod is done.
+        Return {pod: PodResult} in the order of pods.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+
+        async def schedule(pod):
+            async with semaphore:
+                result = await self.run_pod(pod, fetch)
+            results[pod] = result
+            if on_result != None:
+                await on_result(result)
+
+        await asyncio.gather(*[schedule(pod) for pod in pods])
+        return {pod: results[pod] for pod in pods}
+
+    async def run_pod(self, pod, fetch) -> PodResult:
+        start_time = time.perf_counter()
+        state = {"attempts": 0, "error": None, "fresh": False}
+
+        async def attempts():
+            for retry in range(self.retries + 1):
+                if retry != 0:
+                    delay = min(self.max_backoff, self.backoff * 2 ** (retry - 1))
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                try:
+                    return await self.hedged(pod, fetch, state)
+                except self.retry_on as e:
+                    if isinstance(e, self.fatal):
+                        raise
+                    state["error"] = e
+                    state["fresh"] = state["fresh"] or isinstance(e, self.reconnect_on)
+            raise state["error"]
+
+        try:
+            if self.deadline == None:
+                value = await attempts()
+            else:
+                value = await asyncio.wait_for(attempts(), timeout=self.deadline)
+            status, error = "ok", None
+        except asyncio.TimeoutError as e:
+            # Also raised by the last attempt itself, which is a failure within the deadline.
+            is_deadline = self.deadline != None and time.perf_counter() - start_time >= self.deadline
+            status, error, value = ("timeout" if is_deadline else "failed"), state["error"] or e, None
+        except Exception as e:
+            status, error, value = "failed", e, None
+        return PodResult(
+            pod,
+            status,
+            value=value,
+            error=error,
+            attempts=state["attempts"],
+            elapsed=time.perf_counter() - start_time,
+        )
+
+    async def hedged(self, pod, fetch, state):
+        async def attempt(hedge):
+            state["attempts"] += 1
+            with tracer.span("vmm.pod_attempt", pod=pod, hedge=hedge):
+                return await fetch(pod, hedge or state["fresh"])
+
+        first = asyncio.ensure_future(attempt(False))
+        pending = set([first])
+        # Every way out, the deadline of run_pod() included, cancels the attempts still running.
+        try:
+            if self.hedge_after == None:
+                return await first
+            done, _ = await asyncio.wait([first], timeout=self.hedge_after)
+            if len(done) != 0:
+                return first.result()
+            tracer.count("vmm.hedged")
+            pending.add(asyncio.ensure_future(attempt(True)))
+            error = None
+            while len(pending) != 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() == None:
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
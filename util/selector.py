@@ -0,0 +1,96 @@
+# standard library
+import os
+import json
+import time
+import asyncio
+
+
+class ServerSelector:
+    """
+    Pick a jumphost or pod using latency history kept on disk.
+    history = {
+        "kind:host": {"ewma": seconds, "updated": epoch},
+        ...
+    }
+    While every candidate has a fresh entry (within ttl) the best one is only probed to check it still answers.
+    Otherwise, or if it does not answer, all candidates are raced and the first good responder wins; the rest keep
+    running in the background and update the history before it is saved.
+    Failures are recorded in the history too, see update().
+    """
+
+    def __init__(self, path: str, ttl=3600, alpha=0.3, timeout=4):
+        self.path = path
+        self.ttl = ttl
+        self.alpha = alpha
+        self.timeout = timeout
+        self.pending = []
+        self.history = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="UTF-8") as f:
+                    self.history = json.load(f)
+            except ValueError:
+                self.history = {}
+
+    async def select(self, kind, servers, probe):
+        """
+        probe(server) is a coroutine returning the latency in seconds, or float("inf") on failure.
+        Return (server, is_cached), or (None, False) if no server answers.
+        """
+        cached = self.get_cached(kind, servers)
+        if cached != None:
+            # The connection made by the probe is used right after anyway.
+            _, latency = await self.measure(kind, cached, probe)
+            if latency != float("inf"):
+                return cached, True
+            servers = [server for server in servers if server != cached]
+        tasks = [
+            asyncio.ensure_future(self.measure(kind, server, probe)) for server in servers
+        ]
+        self.pending.extend(tasks)
+        for task in asyncio.as_completed(tasks):
+            server, latency = await task
+            if latency != float("inf"):
+                return server, False
+        return None, False
+
+    def get_cached(self, kind, servers):
+        now = time.time()
+        best, best_latency = None, self.timeout
+        for server in servers:
+            entry = self.history.get(f"{kind}:{server}")
+            if entry == None or now - entry["updated"] > self.ttl:
+                return None
+            if entry["ewma"] < best_latency:
+                best, best_latency = server, entry["ewma"]
+        return best
+
+    async def measure(self, kind, server, probe):
+        latency = await probe(server)
+        self.update(kind, server, latency)
+        return server, latency
+
+    def mark_failed(self, kind, server) -> None:
+        self.update(kind, server, float("inf"))
+
+    def update(self, kind, server, latency) -> None:
+        # A failure counts as the timeout so a single bad run does not ban the host forever.
+        sample = min(latency, self.timeout)
+        key = f"{kind}:{server}"
+        entry = self.history.get(key)
+        if entry == None:
+            ewma = sample
+        else:
+            ewma = self.alpha * sample + (1 - self.alpha) * entry["ewma"]
+        self.history[key] = {"ewma": ewma, "updated": time.time()}
+
+    async def wait(self) -> None:
+        await asyncio.gather(*self.pending)
+        self.pending.clear()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="UTF-8") as f:
+            json.dump(self.history, f, indent=2)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,67 @@
+# standard library
+import os
+import hashlib
+
+
+class SessionTemplate:
+    """
+    SecureCRT's Default.ini parsed once and kept in memory.
+    Every session is rendered by replacing only the keyed lines below, without touching the disk.
+    """
+
+    # (key, marker, match only at the beginning of the line)
+    KEYS = (
+        ("hostname", 'S:"Hostname"=', True),
+        ("username", 'S:"Username"=', False),
+        ("password", 'S:"Password V2"=', True),
+        ("password_saved", 'D:"Session Password Saved"=', True),
+        ("protocol", 'S:"Protocol Name"=', True),
+        ("port", 'D:"Port"=', True),
+        ("port", 'D:"[SSH2] Port"=', True),
+        ("firewall", 'S:"Firewall Name"=', True),
+    )
+
+    cache = {}
+
+    def __init__(self, default_ini: str):
+        self.lines = []
+        self.index = {}
+        with open(default_ini, "r", encoding="UTF-8") as f:
+            for line in f:
+                key = self.get_key(line)
+                if key != None:
+                    self.index.setdefault(key, []).append(len(self.lines))
+                self.lines.append(line)
+        self.digest = hashlib.sha256("".join(self.lines).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def load(cls, default_ini: str):
+        """
+        Return the parsed template, reusing it while Default.ini is not modified.
+        """
+        stat = os.stat(default_ini)
+        cache_key = (default_ini, stat.st_mtime_ns, stat.st_size)
+        if cache_key not in cls.cache:
+            cls.cache = {cache_key: cls(default_ini)}
+        return cls.cache[cache_key]
+
+    def get_key(self, line: str):
+        key = None
+        for name, marker, at_start in self.KEYS:
+            if line.startswith(marker) if at_start else marker in line:
+                key = name
+        return key
+
+    def has(self, key: str) -> bool:
+        return key in self.index
+
+    def render(self, fields: dict) -> str:
+        """
+        fields = {key: replaced_line, ...}
+        Lines whose key is not in fields are kept as they are in Default.ini.
+        """
+        lines = self.lines.copy()
+        for key, line in fields.items():
+            for position in self.index.get(key, ()):
+                lines[position] = line
+        return "".join(lines)
@@ -0,0 +1,137 @@
+# standard library
+import os
+import json
+import time
+import inspect
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# 3rd party packages
+from rich import print as rprint
+
+
+class Tracer:
+    """
+    Nested timing spans and counters of a run, enabled with '--profile'.
+    Spans nest per thread and per asyncio task, so concurrent LRM, VMM and writer work is traced correctly.
+    Nothing is recorded while disabled, and span() costs a single check then.
+    The trace is written in Chrome's trace event format, which chrome://tracing and Perfetto can open.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.parent = contextvars.ContextVar("jlab2crt_span", default=None)
+        self.origin = time.perf_counter()
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.origin = time.perf_counter()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.spans = []
+            self.counters = {}
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, **args):
+        if self.enabled == False:
+            yield
+            return
+        record = {"name": name, "args": args, "parent": self.parent.get()}
+        token = self.parent.set(name)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            record["start"] = start_time - self.origin
+            record["duration"] = time.perf_counter() - start_time
+            record["thread"] = threading.get_ident()
+            self.parent.reset(token)
+            with self.lock:
+                self.spans.append(record)
+
+    def traced(self, name: str):
+        """
+        Decorator to run a function, or a coroutine function, in a span.
+        """
+
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name: str, value=1) -> None:
+        if self.enabled == False:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> None:
+        """
+        Print spans aggregated by name and parent, and counters.
+        """
+        from rich.table import Table
+
+        summary = {}
+        for record in self.spans:
+            key = (record["name"], record["parent"])
+            calls, total, longest = summary.get(key, (0, 0, 0))
+            summary[key] = (
+                calls + 1,
+                total + record["duration"],
+                max(longest, record["duration"]),
+            )
+        table = Table(title="Profile")
+        table.add_column("Span")
+        table.add_column("Parent")
+        table.add_column("Calls", justify="right")
+        table.add_column("Total (s)", justify="right")
+        table.add_column("Max (s)", justify="right")
+        for (name, parent), (calls, total, longest) in sorted(
+            summary.items(), key=lambda item: -item[1][1]
+        ):
+            table.add_row(name, parent or "-", str(calls), f"{total:.3f}", f"{longest:.3f}")
+        rprint(table)
+        for name, value in sorted(self.counters.items()):
+            rprint(f" - {name}: [green]{value}[/green]")
+
+    def save(self, path: str) -> None:
+        events = []
+        for record in self.spans:
+            events.append(
+                {
+                    "name": record["name"],
+                    "ph": "X",
+                    "ts": record["start"] * 1000000,
+                    "dur": record["duration"] * 1000000,
+                    "pid": os.getpid(),
+                    "tid": record["thread"],
+                    "args": {key: str(value) for key, value in record["args"].items()},
+                }
+            )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="UTF-8") as f:
+            json.dump({"traceEvents": events, "counters": self.counters}, f)
+
+
+tracer = Tracer()
@@ -1,3 +1,4 @@
+import sys
 from enum import Enum
 
 
@@ -9,3 +10,24 @@ class SessionType(Enum):
     RE1_CON = 4
     VMM_JH = 5
     VMM = 6
+
+
+class Session:
+    """
+    Compact session record shared by LRM, VMM and CRT.
+    Slotted to avoid a per-session __dict__, with the port kept as int and
+    the few repeated strings (protocol, jumphost) interned.
+    """
+
+    __slots__ = ("type", "file_name", "host", "protocol", "port", "jumphost")
+
+    def __init__(self, type, file_name, host, protocol, port, jumphost=None):
+        self.type = type
+        self.file_name = file_name
+        self.host = host
+        self.protocol = sys.intern(protocol)
+        self.port = int(port)
+        self.jumphost = sys.intern(jumphost) if jumphost != None else None
+
+    def __repr__(self):
+        return f"Session({self.type.name}, {self.file_name}, {self.host}, {self.protocol}, {self.port}, {self.jumphost})"
@@ -1,6 +1,9 @@
 # standard library
 import os
+import shlex
 import getpass
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 # 3rd party packages
 import asyncssh
@@ -8,12 +11,20 @@ import asyncio
 from rich import print as rprint
 
 # local modules
-from util.type import SessionType
+from util.type import SessionType, Session
 from util.crt import CRT
+from util.pool import ConnectionPool
+from util.hostkey import HostKeyStore
+from util.selector import ServerSelector
+from util.scheduler import PodScheduler
+from util.filter import get_filter
+from util.timing import tracer
+
+POD_MARKER = "--JLAB2CRT-POD--"
 
 
 class VMM:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, keep_alive=False):
         self.config = config
         self.path = config["crt_path"]
         self.top_dir = config["directory"]["vmm"]["top"]
@@ -25,115 +36,195 @@ class VMM:
         self.jh_list = config["vmm"]["jumphost"]["hosts"]
         self.adpassword = config["vmm"]["adpassword"]
         self.labpassword = config["vmm"]["labpassword"]
-        self.exclude_kwd = [
-            exclude_kwd.lower() for exclude_kwd in config["vmm"]["keyword"]["exclude"]
-        ]
+        self.filter = get_filter(config, "vmm")
         self.username = getpass.getuser()
         self.jh = None
         self.pod = None
+        self.pod_hosts = {}
+        self.jh_crt = None
+        # Keep SSH connections open after run() so that the next run reuses them. Close them with shutdown().
+        self.keep_alive = keep_alive
+        ssh_config = config["vmm"].get("ssh_config")
+        self.host_keys = None
+        if config["vmm"].get("host_key_check") == "accept-new":
+            self.host_keys = HostKeyStore(
+                config["vmm"].get("known_hosts") or "~/.ssh/known_hosts"
+            )
+        self.pool = ConnectionPool(
+            self.username,
+            ssh_config=os.path.expanduser(ssh_config) if ssh_config else None,
+            host_keys=self.host_keys,
+        )
+        latency = config["vmm"].get("latency") or {}
+        self.selector = ServerSelector(
+            os.path.join(config["cache_dir"], "latency.json"),
+            ttl=latency.get("ttl", 3600),
+            alpha=latency.get("alpha", 0.3),
+        )
+        schedule = config["vmm"].get("schedule") or {}
+        deadline = schedule.get("deadline", 30)
+        retries = schedule.get("retries", 2)
+        # By default a hung command takes only its share of the deadline, so that the retries still get theirs.
+        self.command_timeout = config["vmm"].get("command_timeout") or (
+            30 if deadline == None else deadline / (max(0, retries) + 1)
+        )
+        self.scheduler = PodScheduler(
+            concurrency=schedule.get("concurrency") or 8,
+            deadline=deadline,
+            retries=retries,
+            backoff=schedule.get("backoff", 0.5),
+            hedge_after=schedule.get("hedge_after"),
+            retry_on=(OSError, asyncio.TimeoutError, asyncssh.Error),
+            reconnect_on=(
+                OSError,
+                asyncio.TimeoutError,
+                asyncssh.DisconnectError,
+                asyncssh.ChannelOpenError,
+            ),
+        )
+        self.pod_results = {}
+        # Directories of the pods that could not be queried. They are kept instead of expired.
+        self.failed_dirs = set()
 
+    @tracer.traced("vmm.run")
     def run(self) -> None:
-        if self.use_jh == True:
-            session = {}
-            self.get_server(SessionType.JUMPHOST)
-            jh_session = {
-                "type": SessionType.JUMPHOST,
-                "file_name": self.jh + ".ini",
-                "host": self.jh,
-                "protocol": "SSH2",
-                "port": "22",
-                "jumphost": None,
-            }
-            session[self.jh_dir] = [jh_session]
-            CRT(self.config, "vmm", session, True).add_sessions(
-                os.path.join(self.path, self.top_dir, self.sub_dir, self.jh_dir),
-                self.jh_dir,
-            )
-            self.get_server(SessionType.VMM_JH)
-            pods = self.get_pod(SessionType.VMM_JH)
-            sessions = self.get_sessions(SessionType.VMM_JH, pods)
-            crt = CRT(self.config, "vmm", sessions, False)
-        if self.use_jh == False:
-            self.get_server(SessionType.VMM)
-            pods = self.get_pod(SessionType.VMM)
-            sessions = self.get_sessions(SessionType.VMM, pods)
-            crt = CRT(self.config, "vmm", sessions, False)
-        crt.run()
+        loop = asyncio.get_event_loop()
+        crt = loop.run_until_complete(self.collect())
+        if crt.backend != None:
+            try:
+                crt.export(self.jh_crt)
+            finally:
+                crt.credentials.clear()
+        elif crt.sync_mode == "rebuild":
+            crt.run()
+        else:
+            crt.finish_sync()
+            crt.credentials.clear()
 
-    def get_server(self, session_type):
-        async def conn_svr(server):
-            # jumphost or vmm w/o jumphost
-            if session_type.value == 0 or session_type.value == 6:
-                conn = await asyncio.wait_for(
-                    asyncssh.connect(
-                        server,
-                        port=22,
-                        username=self.username,
-                        password=self.adpassword
-                        if session_type.value == 0
-                        else self.labpassword,
-                        client_keys=None,
-                        known_hosts=None,
-                    ),
-                    timeout=4,
+    @tracer.traced("vmm.collect")
+    async def collect(self):
+        """
+        Pipeline of VMM collection.
+        Each pod goes to its 'vmm ip' query as soon as it is resolved, and each pod's bundle is
+        written to the disk on a writer thread while the other pods are still being queried.
+        """
+        loop = asyncio.get_event_loop()
+        crt = CRT(self.config, "vmm", {}, False)
+        # Keep a single writer so bundles are never written concurrently.
+        writer = ThreadPoolExecutor(max_workers=1)
+
+        async def write_bundle(bundle, sessions):
+            if crt.sync_mode == "rebuild":
+                crt.sessions[bundle] = sessions
+            else:
+                await loop.run_in_executor(
+                    writer, contextvars.copy_context().run, crt.sync_bundle, bundle, sessions
                 )
-                async with conn:
-                    start_time = loop.time()
-                    await conn.run('echo "test"')
-                    end_time = loop.time()
-                return conn, end_time - start_time
-            # vmm w/ jumphost
-            if session_type.value == 5:
-                async with asyncssh.connect(
-                    self.jh,
+
+        try:
+            if self.use_jh == True:
+                await self.get_server(SessionType.JUMPHOST)
+                jh_session = Session(
+                    type=SessionType.JUMPHOST,
+                    file_name=self.jh + ".ini",
+                    host=self.jh,
+                    protocol="SSH2",
                     port=22,
-                    username=self.username,
-                    password=self.adpassword,
-                    client_keys=None,
-                    known_hosts=None,
-                ) as tunnel:
-                    conn = await asyncio.wait_for(
-                        asyncssh.connect(
-                            server,
-                            port=22,
-                            username=self.username,
-                            password=self.labpassword,
-                            client_keys=None,
-                            known_hosts=None,
-                            tunnel=tunnel,
-                        ),
-                        timeout=4,
+                    jumphost=None,
+                )
+                jh_crt = CRT(self.config, "vmm", {self.jh_dir: [jh_session]}, True)
+                self.jh_crt = jh_crt
+                if crt.backend == None:
+                    jh_write = loop.run_in_executor(
+                        writer,
+                        contextvars.copy_context().run,
+                        jh_crt.add_sessions,
+                        os.path.join(self.path, self.top_dir, self.sub_dir, self.jh_dir),
+                        self.jh_dir,
                     )
-                    async with conn:
-                        start_time = loop.time()
-                        await conn.run('echo "test"')
-                        end_time = loop.time()
-                    return conn, end_time - start_time
+                else:
+                    # Exported together with the other sessions at the end.
+                    jh_write = None
+                session_type = SessionType.VMM_JH
+            else:
+                jh_write = None
+                session_type = SessionType.VMM
+            await self.get_server(session_type)
+            pods = await self.get_pod(session_type)
+            await self.get_sessions(session_type, pods, write_bundle)
+            crt.kept_dirs |= self.failed_dirs
+            if jh_write != None:
+                await jh_write
+                jh_crt.credentials.clear()
+        finally:
+            await self.close()
+            writer.shutdown()
+        return crt
+
+    def shutdown(self) -> None:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.pool.close())
+
+    async def exec(self, conn, server, command, check=False):
+        """
+        A command that does not finish within command_timeout closes the connection,
+        so that the pool opens a new one instead of reusing a stuck one.
+        """
+        with tracer.span("ssh.run", host=server, command=command.split()[0]):
+            try:
+                result = await asyncio.wait_for(
+                    conn.run(command, check=check), timeout=self.command_timeout
+                )
+            except asyncio.TimeoutError:
+                conn.close()
+                raise
+        tracer.count("ssh.bytes", len(result.stdout or ""))
+        return result
+
+    def connect(self, server, session_type, fresh=False):
+        """
+        Get a pooled connection to the server, or a new one with fresh. Pods are tunneled through the chosen jumphost if it is used.
+        """
+        # jumphost
+        if session_type.value == 0:
+            return self.pool.connect(server, self.adpassword, fresh=fresh)
+        # vmm w/ jumphost
+        if session_type.value == 5:
+            return self.pool.connect(
+                server, self.labpassword, self.jh, self.adpassword, fresh=fresh
+            )
+        # vmm w/o jumphost
+        return self.pool.connect(server, self.labpassword, fresh=fresh)
+
+    @tracer.traced("vmm.close")
+    async def close(self) -> None:
+        # Let the background probes finish so the latency history is complete.
+        await self.selector.wait()
+        self.selector.save()
+        if self.host_keys != None:
+            self.host_keys.save()
+        if self.keep_alive == False:
+            await self.pool.close()
+        rprint(
+            f"SSH connections: [green]{self.pool.opened}[/green] opened, [green]{self.pool.reused}[/green] reused."
+        )
+
+    @tracer.traced("vmm.get_server")
+    async def get_server(self, session_type):
+        async def conn_svr(server):
+            start_time = loop.time()
+            conn = await self.connect(server, session_type)
+            await self.exec(conn, server, 'echo "test"')
+            end_time = loop.time()
+            return conn, end_time - start_time
 
         async def get_ssh_time(server):
             try:
                 conn, time = await conn_svr(server)
                 return time
-            except asyncssh.Error as e:
-                if "Host key verification failed" in str(e):
-                    hostkeys = asyncssh.HostKeys()
-                    hostkeys.add(server, "ssh-rsa", conn.get_server_host_key())
-                    asyncssh.write_host_key(
-                        os.path.expanduser("~/.ssh/known_hosts"), hostkeys
-                    )
-                    _, time = await conn_svr(server)
-                    return time
-                else:
-                    return float("inf")
-            except (OSError, asyncio.exceptions.TimeoutError):
+            except (asyncssh.Error, OSError, asyncio.exceptions.TimeoutError):
                 return float("inf")
 
-        async def find_fastest_server(servers):
-            tasks = [get_ssh_time(server) for server in servers]
-            results = await asyncio.gather(*tasks)
-            # print(results)
-            return servers[results.index(min(results))]
-
         print(f"Finding the fastest {session_type.name.lower()}...")
         if session_type.value == 0:
             server_list = self.jh_list
@@ -142,216 +233,169 @@ class VMM:
             server_list = self.pod_list
 
         loop = asyncio.get_event_loop()
-        fastest_server = loop.run_until_complete(find_fastest_server(server_list))
-        rprint(
-            f"The fastest server is [green]{fastest_server}[/green]. Choose this server."
+        fastest_server, is_cached = await self.selector.select(
+            self.get_kind(session_type), server_list, get_ssh_time
         )
+        if fastest_server == None:
+            raise Exception(
+                f"[Error] None of the {session_type.name.lower()} servers answered: {', '.join(server_list)}"
+            )
+        if is_cached == True:
+            rprint(
+                f"The fastest server is [green]{fastest_server}[/green] by latency history. Choose this server."
+            )
+        else:
+            rprint(
+                f"The fastest server is [green]{fastest_server}[/green]. Choose this server."
+            )
         if session_type.value == 0:
             self.jh = fastest_server
         if session_type.value == 5 or session_type.value == 6:
             self.pod = fastest_server
 
-    def get_pod(self, session_type):
+    def get_kind(self, session_type) -> str:
+        # Latency to pods depends on which jumphost is used.
+        kind = session_type.name
+        if session_type.value == 5:
+            kind = f"{kind}@{self.jh}"
+        return kind
+
+    @tracer.traced("vmm.get_pod")
+    async def get_pod(self, session_type):
+        """
+        Query the pods' config on the chosen pod, or on the next ones if it fails.
+        Raise if no pod can be queried, so that an empty result is never taken for 'no reservations'.
+        """
         pods = {}
 
         async def conn_svr(server):
+            conn = await self.connect(server, session_type)
+            # Query every pod's config in a single exec instead of one round trip per pod.
+            result = await self.exec(
+                conn, server, self.get_pod_command(self.pod_list)
+            )
+            for pod, config_line in self.parse_pod_result(result.stdout).items():
+                if len(config_line) != 0:
+                    pod_name = pod.split(".")[0]
+                    dir_name = config_line.split("/")[-3]
+                    pods[pod_name] = dir_name
+                    self.pod_hosts[pod_name] = pod
+
+        servers = [self.pod] + [pod for pod in self.pod_list if pod != self.pod]
+        for server in servers:
             try:
-                # jumphost or vmm w/o jumphost
-                if session_type.value == 6:
-                    conn = await asyncio.wait_for(
-                        asyncssh.connect(
-                            server,
-                            port=22,
-                            username=self.username,
-                            password=self.labpassword,
-                            client_keys=None,
-                            known_hosts=None,
-                        ),
-                        timeout=4,
-                    )
-                    async with conn:
-                        for pod in self.pod_list:
-                            result = await conn.run(
-                                f"cat ~/.vmmgr/{pod}.config.db | grep 'Config-file'"
-                            )
-                            if len(result.stdout) != 0:
-                                pod_name = pod.split(".")[0]
-                                dir_name = result.stdout.split("/")[-3]
-                                pods[pod_name] = dir_name
-                # vmm w/ jumphost
-                if session_type.value == 5:
-                    async with asyncssh.connect(
-                        self.jh,
-                        port=22,
-                        username=self.username,
-                        password=self.adpassword,
-                        client_keys=None,
-                        known_hosts=None,
-                    ) as tunnel:
-                        conn = await asyncio.wait_for(
-                            asyncssh.connect(
-                                server,
-                                port=22,
-                                username=self.username,
-                                password=self.labpassword,
-                                client_keys=None,
-                                known_hosts=None,
-                                tunnel=tunnel,
-                            ),
-                            timeout=4,
-                        )
-                        async with conn:
-                            for pod in self.pod_list:
-                                result = await conn.run(
-                                    f"cat ~/.vmmgr/{pod}.config.db | grep 'Config-file'"
-                                )
-                                if len(result.stdout) != 0:
-                                    pod_name = pod.split(".")[0]
-                                    dir_name = result.stdout.split("/")[-3]
-                                    pods[pod_name] = dir_name
-                # print(pods)
-            except asyncssh.Error as e:
-                if "Host key verification failed" in str(e):
-                    hostkeys = asyncssh.HostKeys()
-                    hostkeys.add(server, "ssh-rsa", conn.get_server_host_key())
-                    asyncssh.write_host_key(
-                        os.path.expanduser("~/.ssh/known_hosts"), hostkeys
-                    )
-                    await conn_svr(server)
-                else:
-                    return float("inf")
-            except (OSError, asyncio.exceptions.TimeoutError):
-                return float("inf")
+                await conn_svr(server)
+                self.pod = server
+                return pods
+            except (asyncssh.Error, OSError, asyncio.exceptions.TimeoutError) as e:
+                rprint(
+                    f"[dark_orange][Error] Failed to query pods on '{server}': {e!r}[/dark_orange]"
+                )
+                self.selector.mark_failed(self.get_kind(session_type), server)
+                pods.clear()
+        raise Exception("[Error] Failed to query pods on any of them. Existing sessions are kept.")
 
-        loop = asyncio.get_event_loop()
-        task = conn_svr(self.pod)
-        loop.run_until_complete(asyncio.gather(task))
-        return pods
+    def get_pod_command(self, pod_list) -> str:
+        commands = []
+        for pod in pod_list:
+            commands.append(f"echo {shlex.quote(POD_MARKER + pod)}")
+            commands.append(
+                f"cat ~/.vmmgr/{shlex.quote(pod)}.config.db | grep 'Config-file'"
+            )
+        return "; ".join(commands)
+
+    def parse_pod_result(self, stdout) -> dict:
+        """
+        Split the batched output into {pod: Config-file line(s)} by the marker echoed before each pod.
+        """
+        results = {}
+        pod = None
+        for line in stdout.splitlines(keepends=True):
+            if line.startswith(POD_MARKER):
+                pod = line[len(POD_MARKER) :].strip()
+                results[pod] = ""
+            elif pod != None:
+                results[pod] += line
+        return results
 
-    def get_sessions(self, session_type, pods):
+    @tracer.traced("vmm.get_sessions")
+    async def get_sessions(self, session_type, pods, on_bundle=None):
         """
+        on_bundle(dir_name, sessions) is awaited as soon as each pod's sessions are complete.
         Make session information to deliver in a given form like below.
         sessions = {
-            dir_name: [{
-                "type": ...,
-                "file_name": ...,
-                "host": ...,
-                "protocol": ...,
-                "port": ...,
-            },
-            {
-                "type": ...,
-                "file_name": ...,
-                "host": ...,
-                "protocol": ...,
-                "port": ...,
-            }, ...]
+            dir_name: [
+                Session(type, file_name, host, protocol, port, jumphost),
+                Session(type, file_name, host, protocol, port, jumphost),
+                ...
+            ]
         }
+        Pods are queried by the scheduler, so a slow or failing pod is retried within its deadline.
+        The result of each pod is kept in self.pod_results.
         """
         sessions = {}
+        self.failed_dirs = set()
 
-        def add_session(dir_name, session):
-            if dir_name in sessions:
-                sessions[dir_name].append(session)
-            else:
-                sessions[dir_name] = [session]
-
-        async def conn_svr(server):
+        async def fetch(server, fresh):
+            # Use the pod's full hostname so the connection made while probing is reused.
+            conn = await self.connect(self.pod_hosts.get(server, server), session_type, fresh)
             try:
-                # jumphost or vmm w/o jumphost
-                if session_type.value == 6:
-                    conn = await asyncio.wait_for(
-                        asyncssh.connect(
-                            server,
-                            port=22,
-                            username=self.username,
-                            password=self.adpassword
-                            if session_type.value == 0
-                            else self.labpassword,
-                            client_keys=None,
-                            known_hosts=None,
-                        ),
-                        timeout=4,
-                    )
-                    async with conn:
-                        result = await conn.run(f"vmm ip")
-                        if len(result.stdout) != 0:
-                            lines = result.stdout.strip("\n").splitlines()
-                            for line in lines:
-                                include = False
-                                for keyword in self.exclude_kwd:
-                                    if keyword in line.lower():
-                                        include = True
-                                        break
-                                if not include:
-                                    split_line = line.split()
-                                    session = {
-                                        "type": session_type,
-                                        "file_name": "_".join(split_line) + ".ini",
-                                        "host": split_line[1],
-                                        "protocol": "SSH2",
-                                        "port": "22",
-                                        "jumphost": self.jh,
-                                    }
-                                    add_session(f"{server}_{pods[server]}", session)
-                # vmm w/ jumphost
-                if session_type.value == 5:
-                    async with asyncssh.connect(
-                        self.jh,
-                        port=22,
-                        username=self.username,
-                        password=self.adpassword,
-                        client_keys=None,
-                        known_hosts=None,
-                    ) as tunnel:
-                        conn = await asyncio.wait_for(
-                            asyncssh.connect(
-                                server,
-                                port=22,
-                                username=self.username,
-                                password=self.labpassword,
-                                client_keys=None,
-                                known_hosts=None,
-                                tunnel=tunnel,
-                            ),
-                            timeout=4,
-                        )
-                        async with conn:
-                            result = await conn.run(f"vmm ip")
-                            if len(result.stdout) != 0:
-                                lines = result.stdout.strip("\n").splitlines()
-                                for line in lines:
-                                    include = False
-                                    for keyword in self.exclude_kwd:
-                                        if keyword in line.lower():
-                                            include = True
-                                            break
-                                    if not include:
-                                        split_line = line.split()
-                                        session = {
-                                            "type": session_type,
-                                            "file_name": "_".join(split_line) + ".ini",
-                                            "host": split_line[1],
-                                            "protocol": "SSH2",
-                                            "port": "22",
-                                            "jumphost": self.jh,
-                                        }
-                                        add_session(f"{server}_{pods[server]}", session)
-            except asyncssh.Error as e:
-                if "Host key verification failed" in str(e):
-                    hostkeys = asyncssh.HostKeys()
-                    hostkeys.add(server, "ssh-rsa", conn.get_server_host_key())
-                    asyncssh.write_host_key(
-                        os.path.expanduser("~/.ssh/known_hosts"), hostkeys
-                    )
-                    await conn_svr(server)
-                else:
-                    return float("inf")
-            except (OSError, asyncio.exceptions.TimeoutError):
-                return float("inf")
+                # A failing 'vmm ip' raises, so that it is retried instead of leaving the pod empty.
+                result = await self.exec(conn, server, f"vmm ip", check=True)
+            finally:
+                if fresh == True:
+                    conn.close()
+            return self.parse_vmm_ip(session_type, server, result.stdout)
+
+        async def on_result(result):
+            dir_name = f"{result.pod}_{pods[result.pod]}"
+            if result.status != "ok":
+                self.failed_dirs.add(dir_name)
+                return
+            if len(result.value) != 0:
+                sessions[dir_name] = result.value
+                if on_bundle != None:
+                    await on_bundle(dir_name, sessions[dir_name])
 
         print(f"Gathering target sessions from each pods...")
-        loop = asyncio.get_event_loop()
-        tasks = [conn_svr(pod) for pod in pods]
-        loop.run_until_complete(asyncio.gather(*tasks))
+        self.pod_results = await self.scheduler.run(list(pods), fetch, on_result)
+        self.report_pods()
         return sessions
+
+    def parse_vmm_ip(self, session_type, pod, stdout) -> list:
+        sessions = []
+        for line in stdout.strip("\n").splitlines():
+            split_line = line.split()
+            if len(split_line) < 2:
+                continue
+            if not self.filter.match(line, pod=pod, name=split_line[0], ip=split_line[1]):
+                continue
+            sessions.append(
+                Session(
+                    type=session_type,
+                    file_name="_".join(split_line) + ".ini",
+                    host=split_line[1],
+                    protocol="SSH2",
+                    port=22,
+                    jumphost=self.jh,
+                )
+            )
+        return sessions
+
+    def report_pods(self) -> None:
+        results = self.pod_results.values()
+        ok = [result for result in results if result.status == "ok"]
+        # Hedged attempts count too.
+        retried = [result for result in ok if result.attempts > 1]
+        rprint(
+            f"Pods: [green]{len(ok)}[/green] succeeded ([green]{len(retried)}[/green] in more than one attempt), [green]{len(results) - len(ok)}[/green] failed."
+        )
+        for result in results:
+            if result.status != "ok":
+                rprint(
+                    f"[dark_orange][Error][/dark_orange] Pod '{result.pod}' {result.status} after {result.attempts} attempt(s) in {result.elapsed:.1f}s: {result.error!r}"
+                )
+        if len(ok) != len(results):
+            rprint(
+                f"[dark_orange]Existing sessions of the failed pod(s) are kept as they are.[/dark_orange]"
+            )
@@ -0,0 +1,77 @@
+# standard library
+import os
+import json
+import time
+import random
+import asyncio
+
+# 3rd party packages
+from rich import print as rprint
+
+
+class Watcher:
+    """
+    Refresh sessions periodically in a single long-running process.
+    refresh() is called every interval seconds, shifted by a random jitter so that many users don't hit
+    LRM and the pods at the same moment. It returns {name: seconds} of what it ran.
+    The time of the last refresh and the durations are written to a status file after every refresh.
+    """
+
+    def __init__(self, refresh, cache_dir: str, interval=300, jitter=30):
+        self.refresh = refresh
+        self.status_path = os.path.join(cache_dir, "watch.json")
+        self.interval = interval
+        self.jitter = jitter
+        self.status = {
+            "started": time.time(),
+            "refreshes": 0,
+            "failures": 0,
+            "last_refresh": None,
+            "last_duration": None,
+            "last_timings": {},
+            "last_error": None,
+        }
+
+    def run(self) -> None:
+        rprint(
+            f"Watching reservations every [green]{self.interval}[/green]s (±{self.jitter}s). Press Ctrl+C to stop."
+        )
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                self.refresh_once()
+                delay = max(0, self.interval + random.uniform(-self.jitter, self.jitter))
+                rprint(f"Next refresh in [green]{delay:.0f}[/green]s.")
+                # Sleep on the event loop, so that the keepalives of pooled SSH connections keep running
+                # and a connection that died meanwhile is dropped before the next refresh.
+                loop.run_until_complete(asyncio.sleep(delay))
+        except KeyboardInterrupt:
+            rprint("Stopped watching.")
+
+    def refresh_once(self) -> None:
+        start_time = time.time()
+        try:
+            timings = self.refresh()
+            self.status["last_timings"] = timings
+            self.status["last_error"] = None
+        except Exception as e:
+            # Keep watching. LRM or the pods may be back by the next refresh.
+            self.status["failures"] += 1
+            self.status["last_timings"] = {}
+            self.status["last_error"] = str(e)
+            rprint(f"[dark_orange][Error] Failed to refresh: {e}[/dark_orange]")
+        duration = time.time() - start_time
+        self.status["refreshes"] += 1
+        self.status["last_refresh"] = start_time
+        self.status["last_duration"] = duration
+        rprint(
+            f"Refreshed at [green]{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}[/green] in [green]{duration:.2f}[/green]s."
+        )
+        self.save()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.status_path), exist_ok=True)
+        temp_path = self.status_path + ".tmp"
+        with open(temp_path, "w", encoding="UTF-8") as f:
+            json.dump(self.status, f, indent=2)
+        os.replace(temp_path, self.status_path)
@@ -0,0 +1,37 @@
+# standard library
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParallelWriter:
+    """
+    Run file system work on a thread pool. Creating and writing files is bound by file system latency,
+    which is high on Windows and on network-redirected profiles, so it overlaps well across threads.
+    Results come back in the order of the given tasks, and a failed task does not stop the others.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = max(1, workers)
+
+    def map(self, func, tasks) -> list:
+        """
+        tasks = [(arg, ...), ...]
+        Return [(result, error), ...] in the same order. error is None on success.
+        """
+
+        def call(task):
+            try:
+                return func(*task), None
+            except Exception as e:
+                return None, e
+
+        if self.workers == 1 or len(tasks) <= 1:
+            return [call(task) for task in tasks]
+        # Each task runs in a copy of the caller's context, so profiling spans nest under the caller's span.
+        contexts = [contextvars.copy_context() for _ in tasks]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(tasks))) as executor:
+            return list(
+                executor.map(
+                    lambda context, task: context.run(call, task), contexts, tasks
+                )
+            )